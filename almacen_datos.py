@@ -0,0 +1,137 @@
+"""Almacén de auditorías compartido por todas las sesiones del proceso, sin dependencias de Streamlit.
+
+Cada auditoría se carga y categoriza una sola vez y se guarda junto con su índice de filtros.
+Las sesiones reciben una copia superficial del DataFrame: con copy-on-write (pandas >= 3, fijado en
+requirements.txt) es una vista sin copia de los datos, y cualquier modificación en una sesión copia
+solo lo que cambia, sin tocar la versión compartida. Con pandas 2 la copia superficial compartiría
+buffers escribibles, por eso el módulo no se importa con versiones anteriores.
+
+El almacén tiene un presupuesto de memoria (ASEPEYO_MEMORIA_DATOS_MB, 1024 MB por defecto): al
+superarlo se descartan las auditorías usadas hace más tiempo (LRU). Una entrada se invalida en
+cuanto cambia la huella (fecha y tamaño) de su CSV. Los contadores de aciertos, fallos,
+desalojos e invalidaciones se consultan con `estadisticas_almacen`. El frame multianual de cada
+combinación de años también se guarda aquí (`obtener_multianual`).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from analitica import huella_archivo, cargar_auditoria, combinar_particiones, construir_indice_filtros
+
+if int(pd.__version__.split('.')[0]) < 3:
+    raise ImportError(f"almacen_datos necesita pandas >= 3 (copy-on-write); instalada: {pd.__version__}")
+
+PRESUPUESTO_MB_POR_DEFECTO = 1024
+
+def nuevo_almacen(presupuesto_mb=PRESUPUESTO_MB_POR_DEFECTO):
+    """Almacén vacío con un presupuesto de `presupuesto_mb` MB para los datos guardados."""
+    return {
+        'presupuesto': int(presupuesto_mb * 2**20),
+        'entradas': OrderedDict(),  # clave (ruta o combinación multianual) -> entrada, de la usada hace más tiempo a la más reciente
+        'bloqueo': threading.Lock(),
+        'bloqueos_carga': {},  # clave -> Lock, para que dos sesiones no carguen a la vez la misma entrada
+        'contadores': {'aciertos': 0, 'fallos': 0, 'desalojos': 0, 'invalidaciones': 0},
+    }
+
+def presupuesto_por_entorno():
+    try:
+        return float(os.environ['ASEPEYO_MEMORIA_DATOS_MB'])
+    except (KeyError, ValueError):
+        return PRESUPUESTO_MB_POR_DEFECTO
+
+def tamano_entrada(entrada):
+    """Bytes ocupados por el DataFrame y, si ya se construyó, por su índice de filtros."""
+    tamano = int(entrada['df'].memory_usage(deep=True).sum())
+    if entrada['indice'] is not None:
+        tamano += sum(dim['orden'].nbytes + dim['limites'].nbytes for dim in entrada['indice']['dimensiones'].values())
+    return tamano
+
+def ajustar_presupuesto(almacen):
+    """Desaloja entradas LRU hasta caber en el presupuesto; la más reciente se conserva siempre."""
+    entradas = almacen['entradas']
+    while len(entradas) > 1 and sum(e['bytes'] for e in entradas.values()) > almacen['presupuesto']:
+        entradas.popitem(last=False)
+        almacen['contadores']['desalojos'] += 1
+
+def entrada_vigente(almacen, ruta, huella):
+    """Entrada de `ruta` si sigue correspondiendo a `huella` (la marca como la más reciente), o None."""
+    entradas = almacen['entradas']
+    entrada = entradas.get(ruta)
+    if entrada is not None and entrada['huella'] != huella:
+        del entradas[ruta]
+        almacen['contadores']['invalidaciones'] += 1
+        return None
+    if entrada is not None:
+        entradas.move_to_end(ruta)
+    return entrada
+
+def obtener_o_cargar(almacen, clave, huella, cargar):
+    """Entrada `clave` del almacén; si falta o su huella cambió se construye con `cargar()` (una sola vez
+    aunque la pidan varias sesiones a la vez)."""
+    with almacen['bloqueo']:
+        entrada = entrada_vigente(almacen, clave, huella)
+        if entrada is not None:
+            almacen['contadores']['aciertos'] += 1
+            return entrada
+        bloqueo_carga = almacen['bloqueos_carga'].setdefault(clave, threading.Lock())
+    with bloqueo_carga:
+        # Otra sesión pudo cargarla mientras se esperaba el bloqueo
+        with almacen['bloqueo']:
+            entrada = entrada_vigente(almacen, clave, huella)
+            if entrada is not None:
+                almacen['contadores']['aciertos'] += 1
+                return entrada
+            almacen['contadores']['fallos'] += 1
+        entrada = {'huella': huella, 'df': cargar(), 'indice': None}
+        entrada['bytes'] = tamano_entrada(entrada)
+        with almacen['bloqueo']:
+            almacen['entradas'][clave] = entrada
+            almacen['bloqueos_carga'].pop(clave, None)  # quien llegue ahora ya encuentra la entrada
+            ajustar_presupuesto(almacen)
+    return entrada
+
+def obtener_entrada(almacen, file_path, huella=None):
+    """Entrada de la auditoría, cargándola si no está o si su CSV cambió."""
+    huella = huella_archivo(file_path) if huella is None else tuple(huella)
+    return obtener_o_cargar(almacen, os.path.abspath(file_path), huella, lambda: cargar_auditoria(file_path))
+
+def obtener_auditoria(almacen, file_path, huella=None):
+    """Vista de solo lectura (copia superficial, sin copiar datos) de la auditoría categorizada."""
+    return obtener_entrada(almacen, file_path, huella)['df'].copy(deep=False)
+
+def obtener_indice(almacen, file_path, huella=None):
+    """Índice de filtros de la auditoría; se construye una vez y se guarda con ella."""
+    entrada = obtener_entrada(almacen, file_path, huella)
+    if entrada['indice'] is None:
+        indice = construir_indice_filtros(entrada['df'])
+        with almacen['bloqueo']:
+            if entrada['indice'] is None:
+                entrada['indice'] = indice
+                entrada['bytes'] = tamano_entrada(entrada)
+                ajustar_presupuesto(almacen)
+    return entrada['indice']
+
+def obtener_multianual(almacen, particiones, cargar_particion):
+    """Vista del frame multianual que une `particiones`, pares (año, ruta del CSV).
+
+    Se construye una vez por combinación de años, rutas y huellas, y se guarda en el almacén con
+    el mismo presupuesto que las auditorías: volver a ejecutar la página no concatena de nuevo.
+    `cargar_particion(ruta, huella)` devuelve el DataFrame de cada CSV.
+    """
+    partes = [(año, os.path.abspath(ruta), huella_archivo(ruta)) for año, ruta in particiones]
+    clave = ('multianual', tuple(partes))
+    entrada = obtener_o_cargar(almacen, clave, None, lambda: combinar_particiones(
+        [(año, cargar_particion(ruta, huella)) for año, ruta, huella in partes]))
+    return entrada['df'].copy(deep=False)
+
+def estadisticas_almacen(almacen):
+    """Contadores, número de auditorías guardadas y memoria usada frente al presupuesto (MB)."""
+    with almacen['bloqueo']:
+        return {
+            **almacen['contadores'],
+            'auditorias': len(almacen['entradas']),
+            'memoria_mb': sum(e['bytes'] for e in almacen['entradas'].values()) / 2**20,
+            'presupuesto_mb': almacen['presupuesto'] / 2**20,
+        }
@@ -0,0 +1,542 @@
+"""Núcleo analítico del dashboard, sin dependencias de Streamlit.
+
+Reúne las etapas del pipeline (carga -> categorización -> filtrado -> agregación) para
+poder importarlas, medirlas y probarlas fuera de la interfaz.
+"""
+import os
+import re
+import json
+import hashlib
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import xlsxwriter
+
+# --- Motor de Categorización ---
+mapeo_medidas = {
+    "Regulación de la temperatura de consigna": {"Category": "Medidas de control térmico", "Code": "A.1"},
+    "Sustitución de equipos de climatización": {"Category": "Medidas de control térmico", "Code": "A.2"},
+    "Instalación cortina de aire": {"Category": "Medidas de control térmico", "Code": "A.3"},
+    "Instalación de temporizador digital": {"Category": "Medidas de control térmico", "Code": "A.4"},
+    "Regulación de ventilación mediante sonda de CO2": {"Category": "Medidas de control térmico", "Code": "A.5"},
+    "Recuperadores de calor": {"Category": "Medidas de control térmico", "Code": "A.6"},
+    "Ajuste O2 en caldera gasóleo C": {"Category": "Medidas de control térmico", "Code": "A.7"},
+    "Instalación de Variadores de frecuencia en bombas hidráulicas": {"Category": "Medidas de control térmico", "Code": "A.8"},
+    "Instalación Solar térmica": {"Category": "Medidas de control térmico", "Code": "A.9"},
+    "Aislamiento Térmico de Tuberías y Redes": {"Category": "Medidas de control térmico", "Code": "A.10"},
+    "Mejora de la Eficiencia en Calderas": {"Category": "Medidas de control térmico", "Code": "A.11"},
+    "Optimización de la potencia contratada": {"Category": "Medidas de gestión energética", "Code": "B.1"},
+    "Sistema de Gestión Energética": {"Category": "Medidas de gestión energética", "Code": "B.2"},
+    "Eliminación de la energía reactiva": {"Category": "Medidas de gestión energética", "Code": "B.3"},
+    "Reducción del consumo remanente": {"Category": "Medidas de gestión energética", "Code": "B.4"},
+    "Promover la cultura energética": {"Category": "Medidas de gestión energética", "Code": "B.5"},
+    "Instalación Fotovoltaica": {"Category": "Medidas de gestión energética", "Code": "B.6"},
+    "Instalación de Paneles Solares (Fotovoltaicos o Híbridos)": {"Category": "Medidas de gestión energética", "Code": "B.6"},
+    "Cambio Iluminacion LED": {"Category": "Medidas de control de iluminación", "Code": "C.1"},
+    "Sustitución de luminarias a LED": {"Category": "Medidas de control de iluminación", "Code": "C.1"},
+    "Instalación regletas programables": {"Category": "Medidas de control de iluminación", "Code": "C.2"},
+    "Mejora en el control de la iluminación": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
+    "Mejora en el control actual de iluminación": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
+    "Mejora en el control actual": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
+    "Sustitución de luminarias a LED y mejora en su control": {"Category": "Medidas de control de iluminación", "Code": "C.4"},
+    "Renovación de Equipamiento Específico": {"Category": "Medidas de equipamiento general", "Code": "D.1"}
+}
+
+# Tablas de reglas (categoría, palabras clave). El orden define la prioridad: gana la primera que coincide.
+reglas_intervencion = [
+    ('Instalación de Nuevos Sistemas', ["instalación", "batería", "recuperadores", "solar", "fotovoltaica"]),
+    ('Reforma y Actualización de Equipos', ["sustitución", "cambio", "mejora", "aislamiento"]),
+    ('Operacional y Comportamental', ["prácticas", "cultura", "regulación", "optimización", "reducción"]),
+]
+reglas_funcion = [
+    ('Envolvente y Climatización (HVAC)', ["hvac", "climatización", "temperatura", "ventilación", "aislamiento", "cortina", "calor", "termo"]),
+    ('Iluminación y Electricidad', ["led", "iluminación", "luminarias", "eléctrico", "potencia", "reactiva", "condensadores", "regletas"]),
+    ('Gestión y Estrategia Energética', ["gestión", "fotovoltaica", "solar", "prácticas", "remanente", "cultura"]),
+]
+reglas_ahorro_energetico = [
+    ('Ahorros Térmicos (Gas/Combustible)', ["gasóleo", "diesel", "caldera", "térmica"]),
+    ('Ahorros Eléctricos', ["led", "iluminación", "fotovoltaica", "eléctrico", "potencia", "reactiva", "variadores", "bombas", "regletas"]),
+]
+reglas_tipo = [(i, [nombre_estandar.lower()]) for i, nombre_estandar in enumerate(mapeo_medidas)]
+
+def compilar_reglas(reglas):
+    """Compila cada regla en una alternancia regex de sus palabras clave (en minúsculas)."""
+    return [re.compile('|'.join(re.escape(palabra) for palabra in palabras)) for _, palabras in reglas]
+
+patrones_intervencion = compilar_reglas(reglas_intervencion)
+patrones_funcion = compilar_reglas(reglas_funcion)
+patrones_ahorro_energetico = compilar_reglas(reglas_ahorro_energetico)
+patrones_tipo = compilar_reglas(reglas_tipo)
+
+def primera_coincidencia(medidas, patrones):
+    """Devuelve, para cada fila, el índice de la primera regla que coincide (-1 si ninguna).
+
+    Cada texto distinto de `medidas` se clasifica una sola vez y el resultado se
+    propaga a las filas a través de los códigos categóricos.
+    """
+    codigos_medida = medidas.astype('category')
+    unicos = pd.Series(codigos_medida.cat.categories, dtype=object).str.lower()
+    indice_regla = np.full(len(unicos), -1, dtype=np.int16)
+    for i, patron in enumerate(patrones):
+        pendientes = indice_regla == -1
+        if not pendientes.any():
+            break
+        coincide = unicos[pendientes].str.contains(patron).to_numpy(dtype=bool)
+        indice_regla[np.flatnonzero(pendientes)[coincide]] = i
+    codigos = codigos_medida.cat.codes.to_numpy()
+    return np.where(codigos >= 0, indice_regla[codigos], -1)
+
+def etiquetar(indices, etiquetas, por_defecto, index):
+    """Convierte índices de regla en una columna categórica (el -1 se asigna a `por_defecto`)."""
+    etiquetas = list(etiquetas) + [por_defecto]  # el índice -1 apunta al último elemento: `por_defecto`
+    categorias = list(dict.fromkeys(etiquetas))
+    posiciones = np.array([categorias.index(e) for e in etiquetas], dtype=np.int16)
+    return pd.Series(pd.Categorical.from_codes(posiciones[indices], categories=categorias), index=index)
+
+def categorizar_por_reglas(df_in, reglas, patrones, por_defecto):
+    indices = primera_coincidencia(df_in['Medida'], patrones)
+    return etiquetar(indices, [categoria for categoria, _ in reglas], por_defecto, df_in.index)
+
+def categorizar_por_tipo(df_in):
+    indices = primera_coincidencia(df_in['Medida'], patrones_tipo)
+    return etiquetar(indices, [info['Category'] for info in mapeo_medidas.values()], 'Sin categorizar', df_in.index)
+
+def base_codigo_medida(df_in):
+    indices = primera_coincidencia(df_in['Medida'], patrones_tipo)
+    return etiquetar(indices, [info['Code'] for info in mapeo_medidas.values()], 'Z.Z', df_in.index)
+
+def categorizar_por_intervencion(df_in):
+    return categorizar_por_reglas(df_in, reglas_intervencion, patrones_intervencion, 'Intervenciones Específicas')
+
+def categorizar_por_financiero(df_in):
+    retorno = df_in['Periodo de retorno'].to_numpy()
+    categorias = ['Sin Coste / Inmediato', 'Resultados Rápidos (< 2 años)', 'Proyectos Estándar (2-5 años)', 'Inversiones Estratégicas (> 5 años)']
+    codigos = np.select([retorno <= 0, retorno < 2, retorno <= 5], [0, 1, 2], default=3)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=df_in.index)
+
+def categorizar_por_funcion(df_in):
+    return categorizar_por_reglas(df_in, reglas_funcion, patrones_funcion, 'Otras Funciones')
+
+def categorizar_por_ahorro_energetico(df_in):
+    return categorizar_por_reglas(df_in, reglas_ahorro_energetico, patrones_ahorro_energetico, 'Mixto / Operacional')
+
+mapa_funciones_categorizacion = {
+    'Tipo de Medida': categorizar_por_tipo,
+    'Tipo de Intervención': categorizar_por_intervencion,
+    'Impacto Financiero': categorizar_por_financiero,
+    'Tipo de sistema': categorizar_por_funcion,
+    'Tipo de Ahorro Energético': categorizar_por_ahorro_energetico,
+}
+# Columna precalculada para cada tipo de análisis; el selector solo elige cuál usar como 'Categoría'
+columnas_categoria = {tipo: f'Categoría ({tipo})' for tipo in mapa_funciones_categorizacion}
+
+def codigo_medida(df_in):
+    """'Código Medida' estable por archivo: base del código y nº de aparición dentro de su comunidad.
+
+    La numeración sigue el orden de las filas del archivo completo, así que no cambia al filtrar.
+    Las etiquetas se construyen solo para los pares (base, frecuencia) distintos.
+    """
+    base = df_in['Base Código Medida']
+    frecuencia = df_in.groupby(['Comunidad Autónoma', 'Base Código Medida'], observed=True).cumcount().to_numpy() + 1
+    codigos_base = base.cat.codes.to_numpy().astype(np.int64)
+    sin_categorizar = base.cat.categories.get_indexer(['Z.Z'])[0]
+    frecuencia[codigos_base == sin_categorizar] = 0  # todas las no categorizadas comparten etiqueta
+    multiplicador = int(frecuencia.max(initial=0)) + 1
+    unicas, codigos = np.unique(codigos_base * multiplicador + frecuencia, return_inverse=True)
+    etiquetas = [
+        f"{base.cat.categories[clave // multiplicador]}.{clave % multiplicador}" if clave % multiplicador else 'Sin categorizar'
+        for clave in unicas.tolist()
+    ]
+    return pd.Series(pd.Categorical.from_codes(codigos.reshape(-1), categories=etiquetas), index=df_in.index)
+
+# Columnas que añade `enriquecer_categorias`; forman parte de la versión de la caché en disco
+columnas_derivadas = [*columnas_categoria.values(), 'Base Código Medida', 'Código Medida']
+
+def enriquecer_categorias(df):
+    """Añade todas las variantes de 'Categoría', la 'Base Código Medida' y el 'Código Medida' como columnas categóricas."""
+    for tipo, funcion in mapa_funciones_categorizacion.items():
+        df[columnas_categoria[tipo]] = funcion(df)
+    df['Base Código Medida'] = base_codigo_medida(df)
+    df['Código Medida'] = codigo_medida(df)
+    return df
+
+# --- Esquema y Carga de Datos ---
+# Esquema en memoria de una auditoría: columna -> (dtype, valor para los datos faltantes)
+esquema_auditoria = {
+    'Comunidad Autónoma': ('category', 'Sin especificar'),
+    'Centro': ('category', 'Sin especificar'),
+    'Medida': ('category', 'Sin especificar'),
+    'Ahorro energético': ('float32', 0),
+    'Ahorro económico': ('float32', 0),
+    'Inversión': ('float32', 0),
+    'Periodo de retorno': ('float32', 0),
+}
+
+# Importes que se suman en KPIs y agregados: se guardan en float32 (exacto por fila) pero se suman en
+# float64, porque una suma en float32 de un millón de filas ya se desvía en cientos de euros
+columnas_importe = ['Ahorro energético', 'Ahorro económico', 'Inversión']
+
+def importes_float64(df):
+    """`df` con las columnas de importe en float64, para sumarlas sin error de redondeo."""
+    return df.astype({col: 'float64' for col in columnas_importe if col in df.columns})
+
+def aplicar_esquema(df):
+    """Convierte cada columna al tipo declarado en `esquema_auditoria` y rellena sus faltantes."""
+    columnas = {}
+    for col, (dtype, valor_faltante) in esquema_auditoria.items():
+        if dtype == 'category':
+            columnas[col] = df[col].fillna(valor_faltante).astype(str).str.strip().astype('category')
+        else:
+            columnas[col] = pd.to_numeric(df[col], errors='coerce').fillna(valor_faltante).astype(dtype)
+    return pd.DataFrame(columnas, index=df.index)
+
+def leer_csv_auditoria(file_path):
+    """Lee el CSV original y lo devuelve renombrado, tipado y categorizado."""
+    df = pd.read_csv(file_path)
+    df.columns = df.columns.str.strip()
+    # Unifica el renombrado para manejar tanto CSVs en inglés como en español
+    df.rename(columns={
+        'Center': 'Centro', 'Measure': 'Medida',
+        'Energy Saved': 'Ahorro energético', 'Money Saved': 'Ahorro económico',
+        'Investment': 'Inversión', 'Pay back period': 'Periodo de retorno',
+        'Energía Ahorrada (kWh/año)': 'Ahorro energético', 'Dinero Ahorrado (€/año)': 'Ahorro económico',
+        'Inversión (€)': 'Inversión', 'Periodo de Amortización (años)': 'Periodo de retorno'
+    }, inplace=True)
+    df = aplicar_esquema(df)
+    return enriquecer_categorias(df)
+
+# --- Caché en Disco (Arrow/Feather) ---
+# Cambia cuando cambian el esquema o las reglas, lo que invalida los ficheros ya convertidos
+version_procesado = hashlib.sha1(json.dumps(
+    [esquema_auditoria, columnas_derivadas, mapeo_medidas, reglas_intervencion, reglas_funcion, reglas_ahorro_energetico],
+    ensure_ascii=False
+).encode('utf-8')).hexdigest()
+
+def huella_archivo(file_path):
+    """Huella barata del CSV (fecha de modificación y tamaño) para detectar cambios."""
+    estado = os.stat(file_path)
+    return estado.st_mtime_ns, estado.st_size
+
+def hash_archivo(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(bloque)
+    return sha1.hexdigest()
+
+def ruta_cache(file_path):
+    nombre = os.path.splitext(os.path.basename(file_path))[0] + '.arrow'
+    return os.path.join(os.path.dirname(file_path), '.cache', nombre)
+
+def leer_cache(ruta):
+    """Devuelve (tabla, metadatos de origen) del fichero en caché, o (None, {}) si no es legible."""
+    try:
+        tabla = feather.read_table(ruta, memory_map=True)
+    except (OSError, pa.ArrowInvalid):
+        return None, {}
+    return tabla, json.loads((tabla.schema.metadata or {}).get(b'origen', b'{}'))
+
+def escribir_atomico(ruta, escribir, opcional=False):
+    """Escribe `ruta` con `escribir(temporal)` en un fichero temporal que luego la sustituye.
+
+    Quien lea `ruta` a la vez (otra sesión u otro proceso) ve el fichero anterior o el nuevo
+    completo, nunca uno a medias. Con `opcional` (cachés en disco) un error de escritura se ignora.
+    """
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    except OSError:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        if not opcional:  # en una caché, sin permisos de escritura se trabaja sin caché en disco
+            raise
+
+def escribir_cache(df, ruta, origen):
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**tabla.schema.metadata, b'origen': json.dumps(origen).encode('utf-8')})
+    # Sin comprimir para poder mapearlo en memoria
+    escribir_atomico(ruta, lambda temporal: feather.write_feather(tabla, temporal, compression='uncompressed'), opcional=True)
+
+def cargar_auditoria(file_path):
+    """Carga la auditoría desde la caché columnar y solo reprocesa el CSV si ha cambiado.
+
+    La caché se reutiliza mientras coincidan la fecha y el tamaño del CSV; si solo cambió
+    la fecha (p. ej. tras un checkout), se compara el hash del contenido antes de reconstruir.
+    """
+    mtime_ns, tamano = huella_archivo(file_path)
+    ruta = ruta_cache(file_path)
+    tabla, origen = leer_cache(ruta)
+    if tabla is not None and origen.get('version') == version_procesado and origen.get('tamano') == tamano:
+        if origen.get('mtime_ns') == mtime_ns:
+            return tabla.to_pandas()
+        contenido = hash_archivo(file_path)
+        if origen.get('sha1') == contenido:
+            df = tabla.to_pandas()
+            escribir_cache(df, ruta, {**origen, 'mtime_ns': mtime_ns})
+            return df
+    df = leer_csv_auditoria(file_path)
+    escribir_cache(df, ruta, {
+        'version': version_procesado, 'mtime_ns': mtime_ns, 'tamano': tamano, 'sha1': hash_archivo(file_path)
+    })
+    return df
+
+# --- Nombres de Comunidades ---
+# Nombres que aparecen en los CSV de auditoría (ya normalizados) -> código de comunidad del GeoJSON
+ALIAS_COMUNIDADES = {
+    'andalucia': '01', 'aragon': '02', 'asturias': '03', 'principado de asturias': '03', 'baleares': '04',
+    'islas baleares': '04', 'illes balears': '04', 'canarias': '05', 'cantabria': '06', 'castilla y leon': '07',
+    'castilla la mancha': '08', 'cataluna': '09', 'catalunya': '09', 'valenciana': '10', 'comunidad valenciana': '10',
+    'comunitat valenciana': '10', 'extremadura': '11', 'galicia': '12', 'madrid': '13', 'comunidad de madrid': '13',
+    'murcia': '14', 'region de murcia': '14', 'navarra': '15', 'comunidad foral de navarra': '15',
+    'pais vasco': '16', 'euskadi': '16', 'euskadi pais vasco': '16', 'rioja': '17', 'la rioja': '17',
+    'ceuta': '18', 'melilla': '19',
+}
+# Código de comunidad -> nombre con el que se muestra al unir auditorías de varios años
+NOMBRES_COMUNIDADES = {
+    '01': 'Andalucía', '02': 'Aragón', '03': 'Asturias', '04': 'Baleares', '05': 'Canarias', '06': 'Cantabria',
+    '07': 'Castilla y León', '08': 'Castilla-La Mancha', '09': 'Cataluña', '10': 'Comunidad Valenciana',
+    '11': 'Extremadura', '12': 'Galicia', '13': 'Madrid', '14': 'Murcia', '15': 'Navarra', '16': 'País Vasco',
+    '17': 'La Rioja', '18': 'Ceuta', '19': 'Melilla',
+}
+CLAVES_MEDIDA = ['Comunidad Autónoma', 'Centro', 'Medida']
+
+def normalizar_nombre(nombre):
+    """'Euskadi (País Vasco)' -> 'euskadi pais vasco': sin tildes, minúsculas y solo letras/números."""
+    sin_tildes = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', ' ', sin_tildes.lower()).strip()
+
+def comunidad_canonica(nombre):
+    """'EUSKADI' y 'Euskadi (País Vasco)' -> 'País Vasco'. Los nombres que no se reconocen se dejan igual."""
+    return NOMBRES_COMUNIDADES.get(ALIAS_COMUNIDADES.get(normalizar_nombre(nombre)), nombre)
+
+def aplicar_por_valor(serie, funcion):
+    """`funcion` aplicada una vez por valor distinto de `serie` (categórica en el resultado)."""
+    return serie.astype('category').map(funcion).astype('category')
+
+def claves_medida(df):
+    """Claves de comparación (Comunidad Autónoma, Centro, Medida) de cada fila entre auditorías.
+
+    Los CSV de cada año escriben de forma distinta los mismos nombres ('Castilla y León' /
+    'Castilla Y Leon', 'EUSKADI' / 'Euskadi (País Vasco)'): la comunidad se lleva a su nombre
+    canónico, y todas las columnas se comparan sin mayúsculas, tildes ni signos.
+    """
+    return pd.DataFrame({
+        'Comunidad Autónoma': aplicar_por_valor(df['Comunidad Autónoma'], lambda v: normalizar_nombre(comunidad_canonica(v))),
+        'Centro': aplicar_por_valor(df['Centro'], normalizar_nombre),
+        'Medida': aplicar_por_valor(df['Medida'], normalizar_nombre),
+    }, index=df.index)
+
+# --- Conjunto Multianual Particionado por Año ---
+def año_de_archivo(nombre):
+    """Extrae el año de auditoría del nombre del CSV (p. ej. '2021.csv' -> 2021), o None si no lo tiene."""
+    coincidencia = re.search(r'(?<!\d)(?:19|20)\d{2}(?!\d)', nombre)
+    return int(coincidencia.group()) if coincidencia else None
+
+def agrupar_por_año(files):
+    """Índice de particiones: año -> CSVs de ese año. No carga ningún dato."""
+    particiones = {}
+    for f in files:
+        año = año_de_archivo(f)
+        if año is not None:
+            particiones.setdefault(año, []).append(f)
+    return dict(sorted(particiones.items()))
+
+def combinar_particiones(particiones):
+    """Une las particiones cargadas, pares (año, DataFrame), en un único frame con columna 'Año'.
+
+    Las columnas categóricas se llevan a un diccionario de categorías común antes de
+    concatenar, para que el resultado siga siendo categórico en lugar de pasar a texto. Cada
+    comunidad se escribe con su nombre canónico, el mismo en todos los años.
+    """
+    frames = [
+        df.assign(Año=np.int16(año), **{'Comunidad Autónoma': aplicar_por_valor(df['Comunidad Autónoma'], comunidad_canonica)})
+        for año, df in particiones if not df.empty
+    ]
+    if not frames:
+        return pd.DataFrame()
+    for col in frames[0].select_dtypes('category').columns:
+        categorias = pd.api.types.union_categoricals([f[col] for f in frames], sort_categories=True).categories
+        frames = [f.assign(**{col: f[col].cat.set_categories(categorias)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def clasificar_continuidad(df, año_base, año_comparado):
+    """Compara las medidas (Comunidad Autónoma, Centro, Medida) de dos años: 'Mantenida', 'Eliminada' o 'Nueva'.
+
+    Las medidas se emparejan por `claves_medida`; se muestran con los nombres del año base (los
+    del año comparado para las nuevas).
+    """
+    medidas = df[CLAVES_MEDIDA].astype(str).join(claves_medida(df).add_prefix('clave '))
+    claves = [f'clave {c}' for c in CLAVES_MEDIDA]
+    base = medidas[df['Año'] == año_base].drop_duplicates(claves)
+    comparado = medidas[df['Año'] == año_comparado].drop_duplicates(claves)
+    resultado = base.merge(comparado, on=claves, how='outer', indicator=True, suffixes=('', ' comparado'))
+    for c in CLAVES_MEDIDA:
+        resultado[c] = resultado[c].fillna(resultado.pop(f'{c} comparado'))
+    resultado['Estado'] = resultado.pop('_merge').map({'both': 'Mantenida', 'left_only': 'Eliminada', 'right_only': 'Nueva'})
+    return resultado[[*CLAVES_MEDIDA, 'Estado']]
+
+def ultima_auditoria(df):
+    """Filas del año más reciente en que se auditó cada medida (Comunidad Autónoma, Centro, Medida).
+
+    Una medida auditada en varios años es la misma inversión: solo cuenta su versión más reciente,
+    aunque cada año escriba de forma distinta la comunidad, el centro o la medida (`claves_medida`).
+    """
+    claves = claves_medida(df)
+    ultimo = df['Año'].groupby([claves[c] for c in CLAVES_MEDIDA], observed=True).transform('max')
+    return df[df['Año'] == ultimo]
+
+# --- Cubo de Agregación ---
+def etiquetas_medidas(df, claves):
+    """Medidas distintas de cada grupo unidas con '<br>' (en orden de aparición), sin funciones por grupo."""
+    unicos = df[claves + ['Medida']].drop_duplicates()
+    etiquetas = (unicos['Medida'].astype(str) + '<br>').groupby([unicos[c] for c in claves], observed=True).sum()
+    return etiquetas.str[:-len('<br>')]
+
+def construir_cubo(df, columna_agrupar):
+    """Agrega `df` una sola vez para todos los KPIs y gráficos.
+
+    Devuelve dos niveles del mismo cubo: (columna_agrupar, Categoría) y su resumen por
+    columna_agrupar. Ambos llevan recuentos, sumas de inversión y ahorros y la lista de medidas.
+    """
+    claves = [columna_agrupar, 'Categoría']
+    cubo = importes_float64(df).groupby(claves, observed=True).agg(
+        Recuento=('Medida', 'size'),
+        Inversion_Total=('Inversión', 'sum'),
+        Ahorro_Total_Economico=('Ahorro económico', 'sum'),
+        Ahorro_Total_Energia=('Ahorro energético', 'sum')
+    )
+    cubo['Medidas'] = etiquetas_medidas(df, claves)
+    por_grupo = cubo.groupby(level=columna_agrupar, observed=True)[['Recuento', 'Inversion_Total', 'Ahorro_Total_Economico', 'Ahorro_Total_Energia']].sum()
+    por_grupo['Medidas'] = etiquetas_medidas(df, [columna_agrupar])
+    return cubo.reset_index(), por_grupo.reset_index()
+
+def indicadores_resumen(resumen_grupo):
+    """KPIs de cabecera a partir del resumen por grupo: inversión, ahorros y ROI anual (%)."""
+    inversion = resumen_grupo['Inversion_Total'].sum()
+    ahorro_economico = resumen_grupo['Ahorro_Total_Economico'].sum()
+    return {
+        'inversion': inversion,
+        'ahorro_economico': ahorro_economico,
+        'ahorro_energetico': resumen_grupo['Ahorro_Total_Energia'].sum(),
+        'roi': (ahorro_economico / inversion) * 100 if inversion > 0 else 0,
+    }
+
+# --- Índice de Filtros ---
+def construir_indice_filtros(df):
+    """Índice invertido de los filtros de la barra lateral.
+
+    Para cada dimensión filtrable guarda las posiciones de fila agrupadas por categoría
+    (`orden`, con `limites[c]:limites[c + 1]` para la categoría c), y la lista de centros
+    de cada comunidad para el selector de centros.
+    """
+    dimensiones = {}
+    for col in ['Comunidad Autónoma', 'Centro', 'Medida', columnas_categoria['Impacto Financiero']]:
+        codigos = df[col].cat.codes.to_numpy()
+        orden = np.argsort(codigos, kind='stable').astype(np.int32)
+        dimensiones[col] = {
+            'categorias': df[col].cat.categories,
+            'orden': orden,
+            'limites': np.searchsorted(codigos[orden], np.arange(len(df[col].cat.categories) + 1)),
+        }
+    pares = df[['Comunidad Autónoma', 'Centro']].drop_duplicates()
+    centros_por_comunidad = {
+        comunidad: sorted(centros.tolist()) for comunidad, centros in pares.groupby('Comunidad Autónoma', observed=True)['Centro']
+    }
+    return {'n_filas': len(df), 'dimensiones': dimensiones, 'centros_por_comunidad': centros_por_comunidad}
+
+def mascara_filtro(indice, columna, valores):
+    """Máscara booleana de las filas cuyo valor en `columna` está en `valores` (None si no filtra nada)."""
+    dim = indice['dimensiones'][columna]
+    codigos = np.unique(dim['categorias'].get_indexer(valores))
+    codigos = codigos[codigos >= 0]
+    if len(codigos) == len(dim['categorias']):
+        return None
+    inicio, fin = dim['limites'][codigos], dim['limites'][codigos + 1]
+    longitudes = fin - inicio
+    # Concatena los tramos [inicio, fin) de cada categoría sin bucle en Python
+    posiciones = np.arange(longitudes.sum()) + np.repeat(inicio - (np.cumsum(longitudes) - longitudes), longitudes)
+    mascara = np.zeros(indice['n_filas'], dtype=bool)
+    mascara[dim['orden'][posiciones]] = True
+    return mascara
+
+def resolver_filtros(indice, filtros):
+    """Interseca las máscaras de `filtros` (columna -> valores) y devuelve las posiciones de fila resultantes."""
+    mascara = None
+    for columna, valores in filtros.items():
+        mascara_columna = mascara_filtro(indice, columna, valores)
+        if mascara_columna is not None:
+            mascara = mascara_columna if mascara is None else mascara & mascara_columna
+    return np.arange(indice['n_filas']) if mascara is None else np.flatnonzero(mascara)
+
+# --- Tablas y Exportación por Bloques ---
+TAMANO_BLOQUE_EXPORTACION = 50_000
+MAX_FILAS_EXCEL = 1_048_576
+
+def tabla_explicacion(tipo_analisis, categorias):
+    """Tabla de explicación de categorías: el catálogo de medidas o las categorías presentes."""
+    if tipo_analisis == 'Tipo de Medida':
+        return pd.DataFrame([
+            (info['Category'], desc, info['Code']) for desc, info in mapeo_medidas.items()
+        ], columns=['Categoría', 'Descripción Medida', 'Prefijo Código']).sort_values(by='Prefijo Código')
+    categorias = sorted(categorias)
+    return pd.DataFrame({'Categoría': categorias, 'Explicación': categorias})
+
+def orden_filas(df, columna, ascendente=True):
+    """Posiciones de fila de `df` ordenadas por `columna` (orden estable), sin reordenar el frame."""
+    return df[columna].reset_index(drop=True).sort_values(ascending=ascendente, kind='stable').index.to_numpy()
+
+def bloques(df, posiciones, columnas, tamano_bloque):
+    seleccion = df[columnas]
+    for inicio in range(0, len(posiciones), tamano_bloque):
+        yield inicio, seleccion.take(posiciones[inicio:inicio + tamano_bloque])
+
+def exportar_csv(df, posiciones, columnas, destino, tamano_bloque=TAMANO_BLOQUE_EXPORTACION):
+    """Escribe en `destino` (binario) las filas `posiciones` de `df` en CSV, un bloque cada vez."""
+    destino.write('\ufeff'.encode('utf-8'))  # BOM para que Excel reconozca las tildes
+    if len(posiciones) == 0:
+        destino.write(df[columnas].head(0).to_csv(index=False).encode('utf-8'))
+    for inicio, bloque in bloques(df, posiciones, columnas, tamano_bloque):
+        destino.write(bloque.to_csv(index=False, header=inicio == 0).encode('utf-8'))
+
+def valores_celda(columna):
+    """Valores nativos de Python para xlsxwriter. Los float32 pasan por su decimal más corto
+    (0.7 y no 0.699999988079071, que es lo que da convertirlos directamente a float)."""
+    if columna.dtype == np.float32:
+        return columna.to_numpy().astype(str).astype(np.float64).tolist()
+    return columna.tolist()
+
+def exportar_excel(df, posiciones, columnas, destino, tamano_bloque=TAMANO_BLOQUE_EXPORTACION):
+    """Escribe las filas `posiciones` de `df` en una hoja Excel, bloque a bloque y en modo de memoria constante.
+
+    Se usa xlsxwriter directamente porque en modo `constant_memory` las filas deben escribirse
+    en orden, y `DataFrame.to_excel` escribe celda a celda por columnas.
+    """
+    if len(posiciones) + 1 > MAX_FILAS_EXCEL:
+        raise ValueError(f"La selección tiene {len(posiciones):,} filas y Excel admite como máximo {MAX_FILAS_EXCEL - 1:,}.")
+    libro = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    hoja = libro.add_worksheet('Datos')
+    hoja.write_row(0, 0, columnas)
+    for inicio, bloque in bloques(df, posiciones, columnas, tamano_bloque):
+        for i, fila in enumerate(zip(*(valores_celda(bloque[col]) for col in columnas)), start=inicio + 1):
+            hoja.write_row(i, 0, fila)
+    libro.close()
+
+# --- Pipeline Completo ---
+def filtrar_auditoria(df, indice, filtros, columna_categoria):
+    """Materializa las filas que cumplen `filtros` exponiendo `columna_categoria` como 'Categoría'."""
+    return df.take(resolver_filtros(indice, filtros)).rename(columns={columna_categoria: 'Categoría'})
+
+def ejecutar_pipeline(file_path, tipo_analisis='Tipo de Medida', filtros=None, columna_agrupar='Comunidad Autónoma'):
+    """Carga -> categoriza -> filtra -> agrega una auditoría. Devuelve (df_filtrado, cubo, resumen_grupo)."""
+    df = cargar_auditoria(file_path)
+    indice = construir_indice_filtros(df)
+    df_filtrado = filtrar_auditoria(df, indice, filtros or {}, columnas_categoria[tipo_analisis])
+    cubo, resumen_grupo = construir_cubo(df_filtrado, columna_agrupar)
+    return df_filtrado, cubo, resumen_grupo
@@ -0,0 +1,126 @@
+"""Benchmark reproducible del pipeline de `analitica` sobre auditorías sintéticas.
+
+Mide tiempo y pico de memoria de cada etapa (carga desde CSV, carga desde la caché
+Arrow, categorización, índice de filtros, filtrado, agregación, optimización de la cartera con
+un presupuesto del 10 % de la inversión total y simulación Monte Carlo por comunidad y por
+centro con los supuestos por defecto) para varios tamaños.
+El pico de memoria sale de tracemalloc, que ve las asignaciones de Python, NumPy y pandas
+pero no los buffers de Arrow: la carga desde caché mapea el fichero y apenas aparece.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --filas 10000 100000 1000000 --centros 5000 --json resultados.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import analitica
+import escenarios
+import optimizacion
+from benchmarks.datos_sinteticos import generar_auditoria
+
+def etapas(ruta_csv):
+    """Devuelve las etapas como (nombre, función) en orden; cada una usa el resultado de las anteriores."""
+    estado = {}
+
+    def carga_csv():
+        if os.path.exists(analitica.ruta_cache(ruta_csv)):
+            os.remove(analitica.ruta_cache(ruta_csv))
+        estado['df'] = analitica.cargar_auditoria(ruta_csv)
+        return len(estado['df']), len(estado['df'])
+
+    def carga_cache():
+        estado['df'] = analitica.cargar_auditoria(ruta_csv)
+        return len(estado['df']), len(estado['df'])
+
+    def categorizar():
+        base = estado['df'][list(analitica.esquema_auditoria)].copy()
+        return len(base), len(analitica.enriquecer_categorias(base))
+
+    def indice():
+        estado['indice'] = analitica.construir_indice_filtros(estado['df'])
+        return len(estado['df']), estado['indice']['n_filas']
+
+    def filtrar():
+        comunidades = estado['df']['Comunidad Autónoma'].cat.categories
+        filtros = {
+            'Comunidad Autónoma': comunidades[::2].tolist(),
+            analitica.columnas_categoria['Impacto Financiero']: ['Resultados Rápidos (< 2 años)', 'Proyectos Estándar (2-5 años)'],
+        }
+        estado['df_filtrado'] = analitica.filtrar_auditoria(
+            estado['df'], estado['indice'], filtros, analitica.columnas_categoria['Tipo de Medida'])
+        return len(estado['df']), len(estado['df_filtrado'])
+
+    def agregar():
+        cubo_comunidad, _ = analitica.construir_cubo(estado['df_filtrado'], 'Comunidad Autónoma')
+        cubo_centro, _ = analitica.construir_cubo(estado['df_filtrado'], 'Centro')
+        return len(estado['df_filtrado']), len(cubo_comunidad) + len(cubo_centro)
+
+    def optimizar():
+        df = estado['df']
+        cartera = optimizacion.optimizar_cartera(df, float(df['Inversión'].sum()) * 0.1)
+        return len(df), len(cartera['posiciones'])
+
+    def simular():
+        df = estado['df']
+        por_comunidad = escenarios.simular_escenarios(df, 'Comunidad Autónoma')
+        por_centro = escenarios.simular_escenarios(df, 'Centro')
+        return len(df), len(por_comunidad) + len(por_centro)
+
+    return [
+        ('carga_csv', carga_csv), ('carga_cache', carga_cache), ('categorizar', categorizar),
+        ('indice', indice), ('filtrar', filtrar), ('agregar', agregar), ('optimizar', optimizar),
+        ('simular', simular),
+    ]
+
+def medir(ruta_csv, repeticiones):
+    """Mejor tiempo de `repeticiones` pasadas sin trazar y pico de memoria de una pasada con tracemalloc."""
+    tiempos = {}
+    for _ in range(repeticiones):
+        for nombre, etapa in etapas(ruta_csv):
+            inicio = time.perf_counter()
+            etapa()
+            tiempos[nombre] = min(tiempos.get(nombre, float('inf')), time.perf_counter() - inicio)
+    resultados = []
+    for nombre, etapa in etapas(ruta_csv):
+        tracemalloc.start()
+        filas_entrada, filas_salida = etapa()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultados.append({
+            'etapa': nombre, 'segundos': tiempos[nombre], 'pico_mb': pico / 2**20,
+            'filas_entrada': filas_entrada, 'filas_salida': filas_salida,
+        })
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--centros', type=int, default=2000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--json', help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    informe = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for filas in args.filas:
+            ruta_csv = os.path.join(directorio, f'sintetica_{filas}.csv')
+            generar_auditoria(filas, args.centros, args.semilla).to_csv(ruta_csv, index=False)
+            print(f"\n{filas:,} filas, {args.centros:,} centros")
+            print(f"{'etapa':<12} {'segundos':>10} {'pico MB':>10} {'filas entrada':>14} {'filas salida':>14}")
+            for r in medir(ruta_csv, args.repeticiones):
+                print(f"{r['etapa']:<12} {r['segundos']:>10.4f} {r['pico_mb']:>10.1f} "
+                      f"{r['filas_entrada']:>14,} {r['filas_salida']:>14,}")
+                informe.append({'filas': filas, 'centros': args.centros, **r})
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
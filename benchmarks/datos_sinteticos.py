@@ -0,0 +1,58 @@
+"""Generador de auditorías sintéticas con la misma forma que `Data/2021.csv`.
+
+Uso:
+    python -m benchmarks.datos_sinteticos --filas 100000 --centros 2000 --salida /tmp/auditoria.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analitica import mapeo_medidas
+
+COMUNIDADES = [
+    'Andalucía', 'Aragón', 'Asturias', 'Islas Baleares', 'Canarias', 'Cantabria', 'Castilla y León',
+    'Castilla-La Mancha', 'Cataluña', 'Comunidad Valenciana', 'Extremadura', 'Galicia', 'Madrid',
+    'Murcia', 'Navarra', 'País Vasco', 'La Rioja',
+]
+
+# Medidas reales más algunas variantes y medidas sin categorizar, como aparecen en los CSV
+MEDIDAS = list(mapeo_medidas) + [
+    'Sustitución equipos de cocina', 'Instalación de batería de condensadores', 'Buenas prácticas energéticas',
+    'Sustitución de termos eléctricos', 'Cambio de caldera de gasóleo', 'Revisión de la envolvente',
+]
+
+def generar_auditoria(filas, centros=1000, semilla=0):
+    """Devuelve un DataFrame con las columnas (en inglés) de `Data/2021.csv`."""
+    rng = np.random.default_rng(semilla)
+    comunidad_de_centro = rng.integers(0, len(COMUNIDADES), size=centros)
+    centro = rng.integers(0, centros, size=filas)
+    medida = rng.integers(0, len(MEDIDAS), size=filas)
+
+    ahorro_energetico = np.round(rng.lognormal(7.8, 1.6, size=filas))
+    ahorro_economico = np.round(ahorro_energetico * rng.uniform(0.08, 0.25, size=filas), 2)
+    # Como en los datos reales, una parte de las medidas no requiere inversión
+    inversion = np.where(rng.random(filas) < 0.2, 0, np.round(rng.lognormal(6.8, 1.8, size=filas)))
+    retorno = np.round(np.divide(inversion, ahorro_economico, out=np.zeros(filas), where=ahorro_economico > 0), 1)
+
+    return pd.DataFrame({
+        'Comunidad Autónoma': np.array(COMUNIDADES, dtype=object)[comunidad_de_centro[centro]],
+        'Center': np.char.add('Centro ', np.char.zfill(centro.astype(str), len(str(centros)))).astype(object),
+        'Measure': np.array(MEDIDAS, dtype=object)[medida],
+        'Energy Saved': ahorro_energetico,
+        'Money Saved': ahorro_economico,
+        'Investment': inversion,
+        'Pay back period': retorno,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=10_000)
+    parser.add_argument('--centros', type=int, default=1000)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', required=True, help="Ruta del CSV a generar")
+    args = parser.parse_args()
+    generar_auditoria(args.filas, args.centros, args.semilla).to_csv(args.salida, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Comprobación del método exacto de `optimizacion` contra fuerza bruta en instancias pequeñas.
+
+Genera instancias aleatorias de hasta 14 medidas (con y sin límite por grupo, límites comunes o
+por grupo, importes enteros y con decimales, empates y medidas sin coste) y compara con la
+enumeración de todas las combinaciones:
+
+- Exacto: valor igual al óptimo, `optimo` a True, selección que respeta presupuesto y límites.
+- Voraz: selección factible, valor no superior al óptimo y cota superior no inferior.
+- Núcleo pequeño: `mejorar_con_nucleo` con un núcleo menor que la instancia devuelve una solución
+  factible y `resolver_exacto` partiendo de ella llega al óptimo (ejercita la poda por cota con
+  un incumbente que no es el voraz).
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.verificar_optimizacion
+    python -m benchmarks.verificar_optimizacion --instancias 2000 --semilla 3
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+import optimizacion
+
+MAX_MEDIDAS = 14
+GRUPOS = ['a', 'b', 'c']
+
+def generar_instancia(rng):
+    """(df, presupuesto, columna_limite, limite_por_grupo) aleatorios."""
+    n = int(rng.integers(1, MAX_MEDIDAS + 1))
+    inversion = rng.integers(0, 100, n).astype(np.float64)
+    ahorro = rng.integers(0, 60, n).astype(np.float64)
+    if rng.random() < 0.3:  # importes con decimales
+        inversion = np.round(inversion * rng.random(n), 2)
+        ahorro = np.round(ahorro * rng.random(n), 2)
+    df = pd.DataFrame({
+        'Inversión': inversion.astype(np.float32),
+        'Ahorro económico': ahorro.astype(np.float32),
+        'Ahorro energético': rng.integers(0, 500, n).astype(np.float32),
+        'Comunidad Autónoma': rng.choice(GRUPOS, n),
+    })
+    presupuesto = float(rng.integers(0, 400))
+    tipo_limite = rng.integers(0, 3)
+    if tipo_limite == 0:
+        return df, presupuesto, None, None
+    if tipo_limite == 1:
+        return df, presupuesto, 'Comunidad Autónoma', float(rng.integers(10, 200))
+    return df, presupuesto, 'Comunidad Autónoma', {g: float(rng.integers(10, 200)) for g in GRUPOS[:2]}
+
+def fuerza_bruta(df, presupuesto, objetivo, columna_limite, limite_por_grupo):
+    """Valor óptimo de las medidas con inversión, enumerando las 2^n combinaciones."""
+    coste = df['Inversión'].to_numpy(dtype=np.float64)
+    valor = np.where(coste > 0, df[objetivo].to_numpy(dtype=np.float64), 0.0).clip(min=0)
+    combinaciones = (np.arange(2 ** len(df))[:, None] >> np.arange(len(df))) & 1
+    factible = combinaciones @ coste <= presupuesto + optimizacion.TOLERANCIA
+    if columna_limite is not None:
+        for g, filas in df.groupby(columna_limite).indices.items():
+            limite = limite_por_grupo.get(g, np.inf) if isinstance(limite_por_grupo, dict) else limite_por_grupo
+            factible &= combinaciones[:, filas] @ coste[filas] <= limite + optimizacion.TOLERANCIA
+    return float((combinaciones[factible] @ valor).max())
+
+def es_factible(df, posiciones, presupuesto, columna_limite, limite_por_grupo):
+    seleccion = df.iloc[posiciones]
+    if seleccion['Inversión'].astype('float64').sum() > presupuesto + 1e-6:
+        return False
+    if columna_limite is None:
+        return True
+    por_grupo = seleccion.groupby(columna_limite)['Inversión'].sum()
+    return all(
+        total <= (limite_por_grupo.get(g, np.inf) if isinstance(limite_por_grupo, dict) else limite_por_grupo) + 1e-6
+        for g, total in por_grupo.items()
+    )
+
+def comprobar(df, presupuesto, columna_limite, limite_por_grupo, objetivo):
+    """Lista de fallos (vacía si todo coincide) de una instancia."""
+    fallos = []
+    # El valor de las medidas sin coste se suma aparte en los dos métodos
+    sin_coste = df.loc[(df['Inversión'] <= 0) & (df[objetivo] > 0), objetivo].astype('float64').sum()
+    optimo = fuerza_bruta(df, presupuesto, objetivo, columna_limite, limite_por_grupo) + sin_coste
+    tolerancia = 1e-6 * max(1.0, optimo)
+
+    exacto = optimizacion.optimizar_cartera(df, presupuesto, objetivo, columna_limite, limite_por_grupo, 'Exacto')
+    if abs(exacto['valor'] - optimo) > tolerancia or not exacto['optimo']:
+        fallos.append(f"exacto: valor {exacto['valor']} (óptimo {optimo}), optimo={exacto['optimo']}")
+    if not es_factible(df, exacto['posiciones'], presupuesto, columna_limite, limite_por_grupo):
+        fallos.append("exacto: selección no factible")
+
+    voraz = optimizacion.optimizar_cartera(df, presupuesto, objetivo, columna_limite, limite_por_grupo, 'Voraz')
+    if voraz['valor'] > optimo + tolerancia or voraz['cota_superior'] < optimo - tolerancia:
+        fallos.append(f"voraz: valor {voraz['valor']}, cota {voraz['cota_superior']} (óptimo {optimo})")
+    if not es_factible(df, voraz['posiciones'], presupuesto, columna_limite, limite_por_grupo):
+        fallos.append("voraz: selección no factible")
+
+    posiciones, coste, valor, grupo, capacidad = optimizacion.preparar_candidatas(
+        df, objetivo, columna_limite, limite_por_grupo, presupuesto)
+    if len(posiciones) > 2:
+        tomadas, _ = optimizacion.resolver_voraz(coste, valor, grupo, capacidad, presupuesto)
+        tomadas = optimizacion.mejorar_con_nucleo(coste, valor, grupo, capacidad, presupuesto, tomadas, nucleo=2)
+        if not es_factible(df, posiciones[tomadas], presupuesto, columna_limite, limite_por_grupo):
+            fallos.append("núcleo: selección no factible")
+        tomadas, demostrado, _ = optimizacion.resolver_exacto(coste, valor, grupo, capacidad, presupuesto, tomadas)
+        if abs(valor[tomadas].sum() + sin_coste - optimo) > tolerancia or not demostrado:
+            fallos.append(f"núcleo: valor {valor[tomadas].sum() + sin_coste} (óptimo {optimo})")
+    return fallos
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instancias', type=int, default=500)
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.semilla)
+    con_fallos = 0
+    for i in range(args.instancias):
+        df, presupuesto, columna_limite, limite_por_grupo = generar_instancia(rng)
+        objetivo = 'Ahorro energético' if i % 4 == 3 else 'Ahorro económico'
+        fallos = comprobar(df, presupuesto, columna_limite, limite_por_grupo, objetivo)
+        if fallos:
+            con_fallos += 1
+            print(f"Instancia {i} (presupuesto {presupuesto}, límite {limite_por_grupo}, {objetivo}):")
+            print(df.to_string())
+            for fallo in fallos:
+                print(f"  {fallo}")
+    print(f"{args.instancias:,} instancias, {con_fallos:,} con fallos")
+    sys.exit(1 if con_fallos else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Instrumentación opcional de las etapas del dashboard (tiempo, pico de memoria y filas).
+
+Se activa con la variable de entorno ASEPEYO_DIAGNOSTICO=1 o con `?diagnostico=1` en la URL.
+Si además se define ASEPEYO_DIAGNOSTICO_LOG, cada etapa se añade a ese fichero como una
+línea JSON para analizarla fuera de línea.
+
+Las etapas se cronometran sin tracemalloc, que ralentiza de forma desigual cada etapa y
+cambiaría su orden. El pico de memoria se mide en una pasada aparte, con
+ASEPEYO_DIAGNOSTICO=memoria o `?diagnostico=memoria`, en la que no se registran tiempos
+(como en `benchmarks/bench_pipeline.py`).
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# tracemalloc es global al proceso: las etapas de la pasada de memoria de todas las sesiones se
+# ejecutan de una en una, para que ninguna detenga el trazado ni reinicie el pico de otra
+_bloqueo_memoria = threading.Lock()
+
+def nuevo_registro(ruta_log=None, memoria=False, origen='ejecución completa'):
+    """Registro de una ejecución del script (o de un panel); se pasa a `medir_etapa` para acumular las etapas.
+
+    Con `memoria` las etapas miden el pico de memoria en lugar del tiempo.
+    """
+    return {'ejecucion': uuid.uuid4().hex[:12], 'ruta_log': ruta_log, 'memoria': memoria, 'origen': origen, 'etapas': []}
+
+@contextmanager
+def medir_etapa(registro, nombre, filas_entrada=None):
+    """Mide la etapa `nombre` y la añade a `registro`. Con registro None no mide nada.
+
+    Devuelve un dict en el que la etapa puede anotar `filas_salida` u otros datos.
+    """
+    info = {'etapa': nombre, 'filas_entrada': filas_entrada, 'filas_salida': None, 'segundos': None, 'pico_mb': None}
+    if registro is None:
+        yield info
+        return
+    if registro['memoria']:
+        with _bloqueo_memoria:
+            ya_trazando = tracemalloc.is_tracing()
+            if not ya_trazando:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                yield info
+            finally:
+                info['pico_mb'] = (tracemalloc.get_traced_memory()[1] - base) / 2**20
+                if not ya_trazando:
+                    tracemalloc.stop()
+                anotar_etapa(registro, info)
+        return
+    inicio = time.perf_counter()
+    try:
+        yield info
+    finally:
+        info['segundos'] = time.perf_counter() - inicio
+        anotar_etapa(registro, info)
+
+def anotar_etapa(registro, info):
+    registro['etapas'].append(info)
+    if registro['ruta_log']:
+        escribir_linea_log(registro, info)
+
+def escribir_linea_log(registro, info):
+    linea = {'ejecucion': registro['ejecucion'], 'origen': registro['origen'], 'marca_tiempo': time.time(), **info}
+    try:
+        with open(registro['ruta_log'], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(linea, ensure_ascii=False, default=str) + '\n')
+    except OSError:
+        pass  # El diagnóstico nunca debe romper el dashboard
+
+def modo_diagnostico(valor):
+    """'tiempo', 'memoria' o None (desactivado) según el valor de ASEPEYO_DIAGNOSTICO o de `?diagnostico=`."""
+    return {'1': 'tiempo', 'memoria': 'memoria'}.get(valor)
+
+def diagnostico_por_entorno():
+    return modo_diagnostico(os.environ.get('ASEPEYO_DIAGNOSTICO'))
+
+def ruta_log_por_entorno():
+    return os.environ.get('ASEPEYO_DIAGNOSTICO_LOG') or None
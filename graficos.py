@@ -0,0 +1,255 @@
+"""Construcción de las figuras Plotly del dashboard, sin dependencias de Streamlit.
+
+Cada función recibe los datos ya agregados (el cubo de `analitica.construir_cubo`) o el
+frame filtrado y devuelve una figura, o None si no hay datos que representar.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from escenarios import PERCENTILES
+from analitica import importes_float64
+from mapa import codigos_comunidad
+
+# Por encima de UMBRAL_WEBGL puntos la dispersión se dibuja con WebGL en lugar de SVG, y por
+# encima de UMBRAL_DENSIDAD el modo automático pasa a un mapa de densidad agregado en el servidor.
+UMBRAL_WEBGL = 1_000
+UMBRAL_DENSIDAD = 20_000
+MODOS_DISPERSION = ['Automático', 'Puntos', 'Densidad']
+CELDAS_DENSIDAD = 40
+INTERVALOS_RETORNO = 20
+MUESTRAS_POR_INTERVALO = 5
+
+def figura_recuento(cubo, columna_agrupar, tipo_analisis, mostrar_porcentaje=False):
+    datos_agregados = cubo[[columna_agrupar, 'Categoría', 'Recuento', 'Medidas']].copy()
+
+    if mostrar_porcentaje:
+        recuentos_totales = datos_agregados.groupby(columna_agrupar, observed=True)['Recuento'].transform('sum')
+        datos_agregados['Porcentaje'] = (datos_agregados['Recuento'] / recuentos_totales) * 100
+        y_val, y_label = 'Porcentaje', 'Porcentaje de Medidas (%)'
+    else:
+        y_val, y_label = 'Recuento', 'Número de Medidas'
+
+    fig1 = px.bar(datos_agregados, x=columna_agrupar, y=y_val, color='Categoría', hover_data=['Medidas'], title=f'Recuento de Medidas por {columna_agrupar}')
+    fig1.update_layout(yaxis_title=y_label, xaxis_title=columna_agrupar, legend_title=tipo_analisis, template="plotly_white")
+    return fig1
+
+def figura_ahorro_energetico(resumen_grupo, columna_agrupar, mostrar_porcentaje=False):
+    agg_energia = resumen_grupo[[columna_agrupar, 'Ahorro_Total_Energia', 'Medidas']].copy()
+
+    if mostrar_porcentaje:
+        ahorro_general_total = agg_energia['Ahorro_Total_Energia'].sum()
+        agg_energia['Porcentaje'] = (agg_energia['Ahorro_Total_Energia'] / ahorro_general_total) * 100 if ahorro_general_total > 0 else 0
+        y_val, y_label = 'Porcentaje', 'Contribución al Ahorro Total (%)'
+    else:
+        y_val, y_label = 'Ahorro_Total_Energia', 'Ahorro Energético (kWh)'
+
+    fig5 = px.bar(agg_energia.sort_values('Ahorro_Total_Energia', ascending=False), x=columna_agrupar, y=y_val, hover_data=['Medidas'], title=f'Ahorro Energético por {columna_agrupar}')
+    fig5.update_layout(yaxis_title=y_label, xaxis_title=columna_agrupar, template="plotly_white")
+    return fig5
+
+def figura_ahorro_economico(resumen_grupo, columna_agrupar):
+    agg_eco = resumen_grupo[[columna_agrupar, 'Ahorro_Total_Economico', 'Recuento']].rename(columns={'Recuento': 'Recuento_Medidas'})
+    fig6 = px.pie(agg_eco, names=columna_agrupar, values='Ahorro_Total_Economico', title=f'Contribución al Ahorro Económico por {columna_agrupar}', hole=0.4, hover_data=['Recuento_Medidas'])
+    fig6.update_traces(hovertemplate='<b>%{label}</b><br>Ahorro Económico: €%{value:,.0f}<br>Nº de Medidas: %{customdata[0]}<extra></extra>')
+    return fig6
+
+def figura_inversion_ahorro(resumen_grupo, columna_agrupar, mostrar_porcentaje=False):
+    resumen_fin = resumen_grupo[[columna_agrupar, 'Inversion_Total', 'Ahorro_Total_Economico']].copy()
+
+    if mostrar_porcentaje and not resumen_fin.empty:
+        inversion_total_todo = resumen_fin['Inversion_Total'].sum()
+        ahorro_total_todo = resumen_fin['Ahorro_Total_Economico'].sum()
+        resumen_fin['Inversión %'] = (resumen_fin['Inversion_Total'] / inversion_total_todo) * 100 if inversion_total_todo > 0 else 0
+        resumen_fin['Ahorro %'] = (resumen_fin['Ahorro_Total_Economico'] / ahorro_total_todo) * 100 if ahorro_total_todo > 0 else 0
+        fig7 = px.scatter(
+            resumen_fin, x='Inversión %', y='Ahorro %', text=columna_agrupar, size='Inversion_Total',
+            color=columna_agrupar, title='% de Contribución a Inversión vs. Ahorro',
+            labels={'Inversión %': '% Inversión Total', 'Ahorro %': '% Ahorro Total'}
+        )
+    else:
+        fig7 = px.scatter(
+            resumen_fin, x='Inversion_Total', y='Ahorro_Total_Economico', text=columna_agrupar,
+            size='Inversion_Total', color=columna_agrupar, title=f'Inversión vs. Ahorro Económico por {columna_agrupar}'
+        )
+    fig7.update_traces(textposition='top center')
+    fig7.update_layout(xaxis_title="Inversión (€)", yaxis_title="Ahorro Anual (€)", template="plotly_white")
+    return fig7
+
+def figura_eficacia_inversion(df_filtrado, tipo_analisis, mostrar_porcentaje=False, modo='Automático'):
+    """Inversión frente a ahorro por medida: burbujas (SVG o WebGL según el tamaño) o mapa de densidad."""
+    datos_grafico = df_filtrado[(df_filtrado['Inversión'] > 0) & (df_filtrado['Ahorro económico'] > 0)].copy()
+    if datos_grafico.empty:
+        return None
+    if mostrar_porcentaje:
+        inversion_total_todo = datos_grafico['Inversión'].astype('float64').sum()
+        ahorro_total_todo = datos_grafico['Ahorro económico'].astype('float64').sum()
+        datos_grafico['Inversión %'] = (datos_grafico['Inversión'] / inversion_total_todo) * 100 if inversion_total_todo > 0 else 0
+        datos_grafico['Ahorro %'] = (datos_grafico['Ahorro económico'] / ahorro_total_todo) * 100 if ahorro_total_todo > 0 else 0
+        eje_x, eje_y = 'Inversión %', 'Ahorro %'
+        label_x, label_y = '% de Inversión Total', '% de Ahorro Total'
+        texto_titulo = "Contribución Relativa a Inversión vs. Ahorro"
+    else:
+        eje_x, eje_y = 'Inversión', 'Ahorro económico'
+        label_x, label_y = 'Inversión (€)', 'Ahorro Anual (€)'
+        texto_titulo = "Inversión vs. Ahorro Anual"
+
+    if modo == 'Densidad' or (modo == 'Automático' and len(datos_grafico) > UMBRAL_DENSIDAD):
+        fig_burbuja = figura_densidad(datos_grafico, eje_x, eje_y, f"{texto_titulo} (densidad de {len(datos_grafico):,} medidas)")
+    else:
+        fig_burbuja = px.scatter(
+            datos_grafico, x=eje_x, y=eje_y, size='Ahorro energético', color='Categoría',
+            hover_name='Medida',
+            hover_data=['Centro'],
+            size_max=60, title=texto_titulo, template="plotly_white",
+            render_mode='webgl' if len(datos_grafico) > UMBRAL_WEBGL else 'svg'
+        )
+        fig_burbuja.update_layout(legend_title=tipo_analisis)
+    fig_burbuja.update_layout(xaxis_title=label_x, yaxis_title=label_y)
+    return fig_burbuja
+
+def figura_densidad(datos_grafico, eje_x, eje_y, titulo):
+    """Rejilla de CELDAS_DENSIDAD x CELDAS_DENSIDAD con el nº de medidas y su ahorro energético por celda.
+
+    Se agrega con NumPy, así que el tamaño de la figura no depende del número de medidas.
+    """
+    x = datos_grafico[eje_x].to_numpy(dtype=float)
+    y = datos_grafico[eje_y].to_numpy(dtype=float)
+    conteos, bordes_x, bordes_y = np.histogram2d(x, y, bins=CELDAS_DENSIDAD)
+    energia, _, _ = np.histogram2d(x, y, bins=[bordes_x, bordes_y], weights=datos_grafico['Ahorro energético'].to_numpy(dtype=float))
+    vacias = conteos.T == 0
+    fig = go.Figure(go.Heatmap(
+        x=(bordes_x[:-1] + bordes_x[1:]) / 2, y=(bordes_y[:-1] + bordes_y[1:]) / 2,
+        z=np.where(vacias, np.nan, conteos.T), customdata=energia.T, colorscale='Viridis',
+        colorbar_title='Nº de Medidas',
+        hovertemplate='x: %{x:,.2f}<br>y: %{y:,.2f}<br>Medidas: %{z:,.0f}<br>Ahorro energético: %{customdata:,.0f} kWh<extra></extra>',
+    ))
+    fig.update_layout(title=titulo, template="plotly_white")
+    return fig
+
+def muestras_por_intervalo(intervalo, prioridad, muestras):
+    """Posiciones de las `muestras` filas de mayor `prioridad` dentro de cada intervalo."""
+    orden = np.lexsort((-prioridad, intervalo))
+    intervalo_ordenado = intervalo[orden]
+    rango = np.arange(len(orden)) - np.searchsorted(intervalo_ordenado, intervalo_ordenado)
+    return orden[rango < muestras]
+
+def figura_periodo_retorno(df_filtrado, mostrar_porcentaje=False):
+    """Histograma calculado en el servidor: se envían los recuentos y, para el hover,
+    las MUESTRAS_POR_INTERVALO medidas de mayor ahorro económico de cada intervalo."""
+    payback_data = df_filtrado[df_filtrado['Periodo de retorno'] > 0]
+    if payback_data.empty:
+        return None
+    if mostrar_porcentaje:
+        y_axis_title = '% del Total de Medidas'
+        title_text = "Distribución Porcentual de los Periodos de Retorno"
+    else:
+        y_axis_title = 'Número de Medidas'
+        title_text = "Distribución de los Periodos de Retorno"
+
+    valores = payback_data['Periodo de retorno'].to_numpy(dtype=float)
+    bordes = np.histogram_bin_edges(valores, bins=INTERVALOS_RETORNO)
+    intervalo = np.clip(np.searchsorted(bordes, valores, side='right') - 1, 0, INTERVALOS_RETORNO - 1)
+    conteos = np.bincount(intervalo, minlength=INTERVALOS_RETORNO)
+
+    seleccion = muestras_por_intervalo(intervalo, payback_data['Ahorro económico'].to_numpy(dtype=float), MUESTRAS_POR_INTERVALO)
+    muestra = payback_data.iloc[seleccion]
+    textos = [[] for _ in conteos]
+    for i, centro, medida, ahorro in zip(intervalo[seleccion].tolist(), muestra['Centro'].astype(str), muestra['Medida'].astype(str), muestra['Ahorro económico'].tolist()):
+        textos[i].append(f"{centro} · {medida} (€{ahorro:,.0f})")
+    resto = conteos - np.array([len(t) for t in textos])
+    textos = ['<br>'.join(t + ([f"... y {r:,} más"] if r > 0 else [])) for t, r in zip(textos, resto.tolist())]
+
+    fig_hist = go.Figure(go.Bar(
+        x=(bordes[:-1] + bordes[1:]) / 2, width=np.diff(bordes),
+        y=conteos / conteos.sum() * 100 if mostrar_porcentaje else conteos,
+        customdata=np.column_stack([bordes[:-1], bordes[1:], conteos, np.array(textos, dtype=object)]),
+        hovertemplate='%{customdata[0]:.1f} – %{customdata[1]:.1f} años<br>Medidas: %{customdata[2]:,}<br>%{customdata[3]}<extra></extra>',
+    ))
+
+    fig_hist.update_layout(
+        title=title_text,
+        template="plotly_white",
+        bargap=0,
+        xaxis_title="Periodo de Retorno (Años)",
+        yaxis_title=y_axis_title
+    )
+    return fig_hist
+
+def figura_sankey(cubo, columna_agrupar):
+    datos_sankey = cubo[['Categoría', columna_agrupar, 'Inversion_Total', 'Ahorro_Total_Economico']].rename(
+        columns={'Ahorro_Total_Economico': 'Ahorro_Total'}).sort_values(['Categoría', columna_agrupar], ignore_index=True)
+    if datos_sankey.empty or datos_sankey['Inversion_Total'].sum() <= 0:
+        return None
+    todos_nodos = list(pd.concat([datos_sankey['Categoría'], datos_sankey[columna_agrupar]]).unique())
+    fig_sankey = go.Figure(data=[go.Sankey(
+        node=dict(pad=15, thickness=20, line=dict(color="black", width=0.5), label=todos_nodos),
+        link=dict(
+            source=[todos_nodos.index(cat) for cat in datos_sankey['Categoría']],
+            target=[todos_nodos.index(center) for center in datos_sankey[columna_agrupar]],
+            value=datos_sankey['Inversion_Total'],
+            hovertemplate='Inversión de %{source.label} a %{target.label}: €%{value:,.0f}<br>' + 'Ahorro resultante: €' + datos_sankey['Ahorro_Total'].map('{:,.0f}'.format) + '<extra></extra>'
+        ))])
+    fig_sankey.update_layout(title_text=f"Flujo de Categoría a {columna_agrupar} por Inversión", font_size=12)
+    return fig_sankey
+
+# Métrica del mapa -> (columna, título de la escala de color)
+METRICAS_MAPA = {
+    'Ahorro económico': ('Ahorro económico', 'Ahorro Anual (€)'),
+    'Inversión': ('Inversión', 'Inversión (€)'),
+    'Retorno de la Inversión': ('ROI', 'ROI anual (%)'),
+}
+
+def figura_mapa(df_filtrado, geojson, metrica='Ahorro económico'):
+    """Coroplético por comunidad; varias grafías de una misma comunidad se suman en su polígono."""
+    agregados = importes_float64(df_filtrado).groupby('Comunidad Autónoma', observed=True)[['Inversión', 'Ahorro económico', 'Ahorro energético']].sum()
+    codigos = codigos_comunidad(agregados.index, geojson)
+    agregados['codigo'] = [codigos[nombre] for nombre in agregados.index]
+    por_codigo = agregados.dropna(subset=['codigo']).groupby('codigo').sum()
+    if por_codigo.empty:
+        return None
+    nombres = {f['id']: f['properties']['nombre'] for f in geojson['features']}
+    por_codigo['Comunidad'] = por_codigo.index.map(nombres)
+    por_codigo['ROI'] = (por_codigo['Ahorro económico'] / por_codigo['Inversión'].where(por_codigo['Inversión'] > 0)).fillna(0) * 100
+    columna, titulo_escala = METRICAS_MAPA[metrica]
+
+    fig_mapa = px.choropleth(
+        por_codigo.reset_index(), geojson=geojson, locations='codigo', color=columna, hover_name='Comunidad',
+        hover_data={'codigo': False, 'Inversión': ':,.0f', 'Ahorro económico': ':,.0f', 'Ahorro energético': ':,.0f', 'ROI': ':.2f'},
+        color_continuous_scale='Greens', title=f'{metrica} por Comunidad Autónoma'
+    )
+    fig_mapa.update_geos(fitbounds='locations', visible=False)
+    fig_mapa.update_layout(coloraxis_colorbar_title=titulo_escala, margin=dict(l=0, r=0, t=40, b=0), template="plotly_white")
+    return fig_mapa
+
+# Métrica de las bandas Monte Carlo -> (prefijo de columna en `simular_escenarios`, título del eje)
+METRICAS_BANDAS = {
+    'Periodo de retorno': ('Retorno', 'Periodo de Retorno (años)'),
+    'Retorno de la Inversión': ('ROI', 'ROI anual medio (%)'),
+}
+
+def figura_bandas_escenarios(bandas, columna_agrupar, metrica='Periodo de retorno', horizonte=None):
+    """Mediana y banda P10-P90 por grupo; los retornos que no llegan dentro del horizonte se dibujan en el horizonte."""
+    prefijo, titulo_eje = METRICAS_BANDAS[metrica]
+    bajo, medio, alto = (f'{prefijo} P{p}' for p in PERCENTILES)
+    datos = bandas.dropna(subset=[medio])
+    if datos.empty:
+        return None
+    valores = datos[[bajo, medio, alto]].to_numpy(dtype=float)
+    textos = np.where(np.isinf(valores), f'> {horizonte}', np.char.mod('%.2f', np.nan_to_num(valores, posinf=0)))
+    if prefijo == 'Retorno' and horizonte is not None:
+        valores = np.minimum(valores, horizonte)
+    fig = go.Figure(go.Scatter(
+        x=datos[columna_agrupar], y=valores[:, 1], mode='markers',
+        marker=dict(size=10, color=np.where(datos[columna_agrupar] == 'Total', '#d62728', '#1f77b4')),
+        error_y=dict(type='data', symmetric=False, array=valores[:, 2] - valores[:, 1], arrayminus=valores[:, 1] - valores[:, 0]),
+        customdata=textos,
+        hovertemplate=f'<b>%{{x}}</b><br>P{PERCENTILES[0]}: %{{customdata[0]}}<br>P{PERCENTILES[1]}: %{{customdata[1]}}'
+                      f'<br>P{PERCENTILES[2]}: %{{customdata[2]}}<extra></extra>',
+    ))
+    fig.update_layout(
+        title=f'{metrica}: mediana y banda P{PERCENTILES[0]}–P{PERCENTILES[2]} por {columna_agrupar}',
+        xaxis_title=columna_agrupar, yaxis_title=titulo_eje, template="plotly_white"
+    )
+    return fig
@@ -0,0 +1,265 @@
+"""Generación por lotes de informes estáticos por comunidad y por centro, sin Streamlit.
+
+Reutiliza la carga, categorización y agregación de `analitica` y las figuras de `graficos`
+para escribir, por cada auditoría de `Data/`, un HTML con los KPIs y los gráficos del
+dashboard para cada comunidad autónoma y/o cada centro (y, con `--imagenes`, un PNG por
+gráfico; requiere kaleido). Los informes se reparten en un pool de procesos; cada proceso
+carga una sola vez cada auditoría que necesita y la reutiliza en todos sus informes.
+
+La regeneración es incremental: `.manifiesto.json` guarda, por informe, una huella de sus
+entradas (filas del grupo, versión del procesado y opciones). Los informes cuya huella no ha
+cambiado y cuyo HTML sigue existiendo no se vuelven a generar.
+
+Uso (desde la raíz del repositorio):
+    python -m informes --salida informes
+    python -m informes --niveles comunidad centro --procesos 4 --imagenes
+"""
+import argparse
+import hashlib
+import html
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.offline
+
+from analitica import (
+    columnas_categoria, version_procesado, cargar_auditoria, construir_cubo, indicadores_resumen, escribir_atomico,
+    aplicar_por_valor, comunidad_canonica, normalizar_nombre
+)
+from graficos import (
+    figura_recuento, figura_ahorro_energetico, figura_ahorro_economico, figura_inversion_ahorro,
+    figura_eficacia_inversion, figura_periodo_retorno, figura_sankey
+)
+
+# Cambia cuando cambia el contenido o el formato de los informes, lo que obliga a regenerarlos
+VERSION_INFORMES = 1
+# Nivel -> columnas que identifican cada grupo
+NIVELES = {
+    'comunidad': ['Comunidad Autónoma'],
+    'centro': ['Comunidad Autónoma', 'Centro'],
+}
+NOMBRE_MANIFIESTO = '.manifiesto.json'
+NOMBRE_PLOTLYJS = 'plotly.min.js'
+
+# --- Datos por Proceso ---
+# Auditorías ya cargadas en este proceso: ruta -> (df, {nivel: {grupo: posiciones}})
+_auditorias = {}
+
+def datos_auditoria(ruta_csv):
+    """Auditoría categorizada y posiciones de fila de cada grupo, cargadas una vez por proceso.
+
+    Los grupos usan el nombre canónico de la comunidad: las filas escritas 'Andalucia' y
+    'Andalucía' van al mismo informe.
+    """
+    if ruta_csv not in _auditorias:
+        df = cargar_auditoria(ruta_csv)
+        claves = df.assign(**{'Comunidad Autónoma': aplicar_por_valor(df['Comunidad Autónoma'], comunidad_canonica)})
+        grupos = {
+            nivel: {
+                (clave if isinstance(clave, tuple) else (clave,)): posiciones
+                for clave, posiciones in claves.groupby(columnas, observed=True).indices.items()
+            }
+            for nivel, columnas in NIVELES.items()
+        }
+        _auditorias[ruta_csv] = (df, grupos)
+    return _auditorias[ruta_csv]
+
+# --- Planificación Incremental ---
+def nombre_archivo(valor):
+    return normalizar_nombre(valor).replace(' ', '-') or 'sin-nombre'
+
+def ruta_informe(auditoria, nivel, grupo):
+    """Ruta relativa del HTML: <auditoría>/<nivel>/<comunidad>[/<centro>].html."""
+    return os.path.join(nombre_archivo(auditoria), nivel, *map(nombre_archivo, grupo)) + '.html'
+
+def huella_grupo(hash_filas, posiciones, opciones):
+    """Huella de las entradas de un informe: sus filas (en orden), el procesado y las opciones."""
+    sha1 = hashlib.sha1(json.dumps([VERSION_INFORMES, version_procesado, opciones], ensure_ascii=False).encode('utf-8'))
+    sha1.update(hash_filas[posiciones].tobytes())
+    return sha1.hexdigest()
+
+def planificar(rutas_csv, niveles, opciones):
+    """Lista de tareas (una por informe) con su huella, en orden de auditoría."""
+    tareas, usados = [], set()
+    for ruta_csv in rutas_csv:
+        df, grupos = datos_auditoria(ruta_csv)
+        hash_filas = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        auditoria = os.path.splitext(os.path.basename(ruta_csv))[0]
+        for nivel in niveles:
+            for grupo, posiciones in grupos[nivel].items():
+                grupo = tuple(str(valor) for valor in grupo)
+                # Grupos distintos cuyos nombres solo difieren en tildes o signos comparten archivo: se numeran
+                destino, n = ruta_informe(auditoria, nivel, grupo), 1
+                while destino in usados:
+                    n += 1
+                    destino = ruta_informe(auditoria, nivel, grupo)[:-len('.html')] + f'-{n}.html'
+                usados.add(destino)
+                tareas.append({
+                    'ruta_csv': ruta_csv, 'auditoria': auditoria, 'nivel': nivel, 'grupo': grupo,
+                    'destino': destino, 'opciones': opciones,
+                    'huella': huella_grupo(hash_filas, posiciones, opciones),
+                })
+    return tareas
+
+def leer_manifiesto(salida):
+    try:
+        with open(os.path.join(salida, NOMBRE_MANIFIESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def escribir_texto(ruta, contenido):
+    def escribir(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+    escribir_atomico(ruta, escribir)
+
+# --- Renderizado ---
+def figuras_informe(df_grupo, tipo_analisis):
+    """(nombre, figura) de los gráficos del dashboard para un grupo, agrupando por centro."""
+    cubo, resumen_grupo = construir_cubo(df_grupo, 'Centro')
+    figuras = [
+        ('recuento', figura_recuento(cubo, 'Centro', tipo_analisis)),
+        ('ahorro_energetico', figura_ahorro_energetico(resumen_grupo, 'Centro')),
+        ('ahorro_economico', figura_ahorro_economico(resumen_grupo, 'Centro')),
+        ('inversion_ahorro', figura_inversion_ahorro(resumen_grupo, 'Centro')),
+        ('eficacia_inversion', figura_eficacia_inversion(df_grupo, tipo_analisis)),
+        ('periodo_retorno', figura_periodo_retorno(df_grupo)),
+        ('sankey', figura_sankey(cubo, 'Centro')),
+    ]
+    return resumen_grupo, [(nombre, fig) for nombre, fig in figuras if fig is not None]
+
+def html_informe(titulo, kpis, figuras, ruta_plotlyjs):
+    bloques_kpi = ''.join(
+        f'<div class="kpi"><div class="etiqueta">{etiqueta}</div><div class="valor">{valor}</div></div>'
+        for etiqueta, valor in [
+            ("Inversión Total", f"€ {kpis['inversion']:,.0f}"),
+            ("Ahorro Económico Total", f"€ {kpis['ahorro_economico']:,.0f}"),
+            ("Ahorro Energético Total", f"{kpis['ahorro_energetico']:,.0f} kWh"),
+            ("Retorno de la Inversión (Cada ano)", f"{kpis['roi']:.2f} %"),
+        ]
+    )
+    graficos = ''.join(fig.to_html(full_html=False, include_plotlyjs=False) for _, fig in figuras)
+    return f"""<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(titulo)}</title>
+<script src="{ruta_plotlyjs}"></script>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+.kpis {{ display: flex; gap: 2em; margin-bottom: 2em; }}
+.kpi .etiqueta {{ color: #555; font-size: 0.9em; }}
+.kpi .valor {{ font-size: 1.6em; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(titulo)}</h1>
+<div class="kpis">{bloques_kpi}</div>
+{graficos}
+</body>
+</html>
+"""
+
+def generar_informe(tarea, salida):
+    """Escribe el HTML (y las imágenes) de un informe. Se ejecuta en los procesos del pool."""
+    df, grupos = datos_auditoria(tarea['ruta_csv'])
+    tipo_analisis = tarea['opciones']['analisis']
+    # Como `filtrar_auditoria`: la columna del análisis activo se expone como 'Categoría'
+    df_grupo = df.take(grupos[tarea['nivel']][tarea['grupo']]).rename(columns={columnas_categoria[tipo_analisis]: 'Categoría'})
+    resumen_grupo, figuras = figuras_informe(df_grupo, tipo_analisis)
+
+    destino = os.path.join(salida, tarea['destino'])
+    ruta_plotlyjs = os.path.relpath(os.path.join(salida, NOMBRE_PLOTLYJS), os.path.dirname(destino)).replace(os.sep, '/')
+    titulo = f"{tarea['auditoria']} - {' / '.join(tarea['grupo'])}"
+    escribir_texto(destino, html_informe(titulo, indicadores_resumen(resumen_grupo), figuras, ruta_plotlyjs))
+    if tarea['opciones']['imagenes']:
+        directorio = os.path.splitext(destino)[0]
+        os.makedirs(directorio, exist_ok=True)
+        for nombre, fig in figuras:
+            fig.write_image(os.path.join(directorio, f'{nombre}.png'), width=1200, height=700)
+    return tarea['destino']
+
+def escribir_indice(salida, tareas):
+    """Índice HTML con un enlace por informe, agrupado por auditoría y nivel."""
+    secciones = []
+    for (auditoria, nivel), grupo in pd.DataFrame(tareas).groupby(['auditoria', 'nivel'], sort=True):
+        enlaces = ''.join(
+            f'<li><a href="{html.escape(destino.replace(os.sep, "/"))}">{html.escape(" / ".join(nombre))}</a></li>'
+            for destino, nombre in sorted(zip(grupo['destino'], grupo['grupo']), key=lambda par: par[1])
+        )
+        secciones.append(f'<h2>{html.escape(auditoria)}: {nivel}</h2><ul>{enlaces}</ul>')
+    escribir_texto(os.path.join(salida, 'index.html'),
+                     f'<!DOCTYPE html><html lang="es"><head><meta charset="utf-8"><title>Informes</title></head>'
+                     f'<body><h1>Informes de Eficiencia Energética</h1>{"".join(secciones)}</body></html>\n')
+
+# --- Ejecución ---
+def generar_informes(rutas_csv, salida, niveles=('comunidad',), tipo_analisis='Tipo de Medida', imagenes=False,
+                     procesos=None, forzar=False):
+    """Genera los informes que faltan o cuyas entradas han cambiado. Devuelve un resumen con los recuentos."""
+    inicio = time.perf_counter()
+    opciones = {'analisis': tipo_analisis, 'imagenes': imagenes}
+    tareas = planificar(rutas_csv, niveles, opciones)
+    manifiesto = {} if forzar else leer_manifiesto(salida)
+    pendientes = [
+        t for t in tareas
+        if manifiesto.get(t['destino']) != t['huella'] or not os.path.exists(os.path.join(salida, t['destino']))
+    ]
+
+    ruta_plotlyjs = os.path.join(salida, NOMBRE_PLOTLYJS)
+    if pendientes and not os.path.exists(ruta_plotlyjs):
+        escribir_texto(ruta_plotlyjs, plotly.offline.get_plotlyjs())
+
+    nuevo_manifiesto = {t['destino']: manifiesto[t['destino']] for t in tareas if t['destino'] in manifiesto}
+    errores = []
+    try:
+        if pendientes:
+            # Los procesos creados por fork heredan las auditorías ya cargadas al planificar
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                futuros = {pool.submit(generar_informe, t, salida): t for t in pendientes}
+                for futuro in as_completed(futuros):
+                    tarea = futuros[futuro]
+                    try:
+                        futuro.result()
+                    except Exception as error:
+                        nuevo_manifiesto.pop(tarea['destino'], None)
+                        errores.append((tarea['destino'], repr(error)))
+                    else:
+                        nuevo_manifiesto[tarea['destino']] = tarea['huella']
+    finally:
+        escribir_texto(os.path.join(salida, NOMBRE_MANIFIESTO), json.dumps(nuevo_manifiesto, ensure_ascii=False, indent=1))
+    if tareas:
+        escribir_indice(salida, tareas)
+    return {
+        'informes': len(tareas), 'generados': len(pendientes) - len(errores), 'sin_cambios': len(tareas) - len(pendientes),
+        'errores': errores, 'segundos': time.perf_counter() - inicio,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datos', default='Data', help="Directorio con los CSV de auditoría")
+    parser.add_argument('--salida', default='informes', help="Directorio donde escribir los informes")
+    parser.add_argument('--niveles', nargs='+', choices=list(NIVELES), default=['comunidad'])
+    parser.add_argument('--analisis', choices=list(columnas_categoria), default='Tipo de Medida')
+    parser.add_argument('--imagenes', action='store_true', help="Exportar también un PNG por gráfico (requiere kaleido)")
+    parser.add_argument('--procesos', type=int, help="Procesos del pool (por defecto, uno por CPU)")
+    parser.add_argument('--forzar', action='store_true', help="Regenerar todos los informes aunque no hayan cambiado")
+    args = parser.parse_args()
+    if args.imagenes:
+        if importlib.util.find_spec('kaleido') is None:
+            parser.error("--imagenes requiere el paquete kaleido (pip install kaleido)")
+
+    rutas_csv = sorted(os.path.join(args.datos, f) for f in os.listdir(args.datos) if f.endswith('.csv'))
+    resumen = generar_informes(rutas_csv, args.salida, args.niveles, args.analisis, args.imagenes, args.procesos, args.forzar)
+    print(f"{resumen['informes']:,} informes: {resumen['generados']:,} generados, "
+          f"{resumen['sin_cambios']:,} sin cambios, {len(resumen['errores']):,} con errores "
+          f"({resumen['segundos']:.1f} s)")
+    for destino, error in resumen['errores']:
+        print(f"  {destino}: {error}")
+
+if __name__ == '__main__':
+    main()
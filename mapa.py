@@ -0,0 +1,103 @@
+"""Geometría de las comunidades autónomas para el mapa coroplético, sin dependencias de Streamlit.
+
+El GeoJSON original (`Data/georef-spain-comunidad-autonoma.geojson`) pesa ~1,8 MB. Aquí se
+procesa una sola vez: se eliminan las propiedades, se simplifican los polígonos con
+Douglas-Peucker a varias tolerancias y se redondean las coordenadas. El resultado se guarda
+en `Data/.cache/` y se reutiliza mientras el GeoJSON no cambie.
+"""
+import json
+import os
+import numpy as np
+
+from analitica import huella_archivo, escribir_atomico, ALIAS_COMUNIDADES, normalizar_nombre
+
+# Nivel de detalle -> tolerancia de simplificación en grados
+TOLERANCIAS = {'Baja': 0.02, 'Media': 0.005, 'Alta': 0.001}
+DECIMALES = 4
+VERSION_GEOMETRIA = 1
+
+def distancia_a_segmento(puntos, inicio, fin):
+    segmento = fin - inicio
+    longitud = np.hypot(*segmento)
+    if longitud == 0:
+        return np.hypot(*(puntos - inicio).T)
+    return np.abs(segmento[0] * (puntos[:, 1] - inicio[1]) - segmento[1] * (puntos[:, 0] - inicio[0])) / longitud
+
+def simplificar_linea(coordenadas, tolerancia):
+    """Douglas-Peucker iterativo: conserva los vértices que se separan más de `tolerancia` de la línea."""
+    puntos = np.asarray(coordenadas, dtype=float)[:, :2]
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[[0, -1]] = True
+    pendientes = [(0, len(puntos) - 1)]
+    while pendientes:
+        a, b = pendientes.pop()
+        if b - a < 2:
+            continue
+        distancias = distancia_a_segmento(puntos[a + 1:b], puntos[a], puntos[b])
+        i = int(np.argmax(distancias))
+        if distancias[i] > tolerancia:
+            medio = a + 1 + i
+            conservar[medio] = True
+            pendientes += [(a, medio), (medio, b)]
+    return puntos[conservar]
+
+def simplificar_poligono(anillos, tolerancia):
+    """Simplifica los anillos de un polígono; descarta los que se reducen a menos de un triángulo."""
+    resultado = []
+    for anillo in anillos:
+        simplificado = simplificar_linea(anillo, tolerancia)
+        if len(simplificado) >= 4:
+            resultado.append(np.round(simplificado, DECIMALES).tolist())
+        elif not resultado:
+            return None  # sin anillo exterior el polígono desaparece a esta escala
+    return resultado
+
+def simplificar_geometria(geometria, tolerancia):
+    poligonos = geometria['coordinates'] if geometria['type'] == 'MultiPolygon' else [geometria['coordinates']]
+    poligonos = [p for p in (simplificar_poligono(anillos, tolerancia) for anillos in poligonos) if p]
+    if not poligonos:
+        return None
+    return {'type': 'MultiPolygon', 'coordinates': poligonos}
+
+def procesar_geojson(ruta_geojson):
+    """Devuelve {nivel: FeatureCollection} con `id` = código de comunidad y solo la propiedad 'nombre'."""
+    with open(ruta_geojson, encoding='utf-8') as f:
+        original = json.load(f)
+    niveles = {}
+    for nivel, tolerancia in TOLERANCIAS.items():
+        features = []
+        for feature in original['features']:
+            propiedades = feature['properties']
+            geometria = simplificar_geometria(feature['geometry'], tolerancia)
+            if geometria is not None and propiedades.get('acom_code'):
+                features.append({
+                    'type': 'Feature', 'id': propiedades['acom_code'],
+                    'properties': {'nombre': propiedades.get('acom_name')}, 'geometry': geometria,
+                })
+        niveles[nivel] = {'type': 'FeatureCollection', 'features': features}
+    return niveles
+
+def cargar_geometrias(ruta_geojson):
+    """Geometrías simplificadas desde la caché en disco; solo se reprocesan si cambia el GeoJSON."""
+    mtime_ns, tamano = huella_archivo(ruta_geojson)
+    origen = {'version': VERSION_GEOMETRIA, 'tolerancias': TOLERANCIAS, 'mtime_ns': mtime_ns, 'tamano': tamano}
+    ruta = os.path.join(os.path.dirname(ruta_geojson), '.cache', 'comunidades_simplificadas.json')
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            guardado = json.load(f)
+        if guardado.get('origen') == origen:
+            return guardado['niveles']
+    except (OSError, ValueError):
+        pass
+    niveles = procesar_geojson(ruta_geojson)
+
+    def escribir(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'origen': origen, 'niveles': niveles}, f, ensure_ascii=False, separators=(',', ':'))
+    escribir_atomico(ruta, escribir, opcional=True)
+    return niveles
+
+def codigos_comunidad(nombres, geojson):
+    """Asocia cada nombre de comunidad de los datos con el código de su polígono (None si no se reconoce)."""
+    alias = {**ALIAS_COMUNIDADES, **{normalizar_nombre(f['properties']['nombre']): f['id'] for f in geojson['features']}}
+    return {nombre: alias.get(normalizar_nombre(nombre)) for nombre in nombres}
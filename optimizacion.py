@@ -0,0 +1,328 @@
+"""Selección de medidas que maximiza el ahorro con un presupuesto dado, sin dependencias de Streamlit.
+
+Es una mochila 0/1 sobre las medidas con inversión: cada medida se toma entera o no se toma,
+la inversión total no puede superar el presupuesto y, opcionalmente, la inversión de cada grupo
+(comunidad, categoría...) tampoco puede superar su límite. Las medidas sin coste con ahorro
+positivo se incluyen siempre.
+
+- Voraz: ordena por ahorro por euro, toma entera la parte que también toma la relajación
+  lineal y completa con las medidas que aún caben. Es vectorial salvo el relleno final y
+  devuelve además la cota de la relajación lineal, que acota el óptimo.
+- Exacto: programación dinámica sobre la frontera de pares (inversión, ahorro) no dominados,
+  en el mismo orden. Parte de la solución voraz, mejorada forzando medidas grandes y
+  resolviendo el núcleo de medidas dudosas, y descarta los estados que, con la cota
+  fraccional de las medidas restantes, no pueden superarla. Si los estados guardados
+  superan MAX_ESTADOS se devuelve esa solución de partida con `optimo` a False.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+OBJETIVOS = {'Ahorro económico': '€', 'Ahorro energético': 'kWh'}
+METODOS = ['Automático', 'Exacto', 'Voraz']
+LIMITE_EXACTO = 5_000
+MAX_ESTADOS = 5_000_000
+PARES_POR_ESTADO = 20
+TAMANO_BLOQUE_PARES = 1_000_000
+NUCLEO = 60
+INTENTOS_FORZADOS = 20
+MAX_ESTADOS_NUCLEO = 500_000
+TOLERANCIA = 1e-9
+
+def preparar_candidatas(df, objetivo, columna_limite=None, limite_por_grupo=None, presupuesto=np.inf):
+    """Medidas que compiten por el presupuesto, ordenadas por ahorro por euro (de mayor a menor).
+
+    Devuelve (posiciones, coste, valor, grupo, capacidad): `grupo` indexa `capacidad`, el límite de
+    inversión de cada grupo (inf si no tiene). `limite_por_grupo` es un importe común a todos los
+    grupos o un dict {grupo: importe}; los grupos que no aparecen en el dict no tienen límite.
+    """
+    coste = df['Inversión'].to_numpy(dtype=np.float64)
+    valor = df[objetivo].to_numpy(dtype=np.float64)
+    if columna_limite is None or limite_por_grupo is None:
+        grupo = np.zeros(len(df), dtype=np.int64)
+        capacidad = np.array([np.inf])
+    else:
+        codigos, grupos = pd.factorize(df[columna_limite], sort=True)
+        grupo = codigos.astype(np.int64)
+        if isinstance(limite_por_grupo, dict):
+            capacidad = np.array([limite_por_grupo.get(g, np.inf) for g in grupos], dtype=np.float64)
+        else:
+            capacidad = np.full(len(grupos), float(limite_por_grupo))
+    # Una medida que no cabe ni sola en el presupuesto o en su grupo no puede formar parte de ninguna solución
+    posiciones = np.flatnonzero((coste > 0) & (valor > 0) & (coste <= presupuesto) & (coste <= capacidad[grupo]))
+    orden = np.argsort(-valor[posiciones] / coste[posiciones], kind='stable')
+    posiciones = posiciones[orden]
+    return posiciones, coste[posiciones], valor[posiciones], grupo[posiciones], capacidad
+
+def resolver_voraz(coste, valor, grupo, capacidad, presupuesto):
+    """Devuelve (máscara de medidas tomadas, cota superior de la relajación lineal)."""
+    # Relajación lineal: con límites anidados (grupos dentro del total) el reparto voraz por ahorro
+    # por euro es óptimo. Primero cada medida recibe lo que le deja su grupo y después el total.
+    orden_grupo = np.argsort(grupo, kind='stable')
+    acumulado_grupo = np.empty_like(coste)
+    acumulado_grupo[orden_grupo] = pd.Series(coste[orden_grupo]).groupby(grupo[orden_grupo]).cumsum().to_numpy()
+    por_grupo = np.clip(capacidad[grupo] - (acumulado_grupo - coste), 0, coste)
+    acumulado = np.cumsum(por_grupo)
+    fraccion = np.clip(presupuesto - (acumulado - por_grupo), 0, por_grupo)
+    cota = float(np.sum(fraccion / coste * valor)) if len(coste) else 0.0
+
+    # Lo que la relajación toma entero es factible; el resto se completa con las que aún caben
+    tomadas = fraccion >= coste
+    restante = presupuesto - coste[tomadas].sum()
+    restante_grupo = capacidad - np.bincount(grupo[tomadas], weights=coste[tomadas], minlength=len(capacidad))
+    for i in np.flatnonzero(~tomadas & (coste <= restante) & (coste <= restante_grupo[grupo])).tolist():
+        c, g = coste[i], grupo[i]
+        if c <= restante and c <= restante_grupo[g]:
+            tomadas[i] = True
+            restante -= c
+            restante_grupo[g] -= c
+    return tomadas, cota
+
+def cota_fraccional(coste_acumulado, valor_acumulado, ratio, inicio, restante):
+    """Ahorro fraccional máximo de las medidas `inicio`.. (ordenadas por ahorro por euro) con `restante` euros.
+
+    `restante` puede ser un array: se evalúa para todos los estados a la vez con búsqueda binaria.
+    """
+    objetivo = coste_acumulado[inicio] + restante
+    j = np.maximum(np.searchsorted(coste_acumulado, objetivo, side='right') - 1, inicio)
+    return valor_acumulado[j] - valor_acumulado[inicio] + (objetivo - coste_acumulado[j]) * ratio[j]
+
+def prefijos(coste, valor, indices):
+    """(coste acumulado, valor acumulado, ahorro por euro) de las medidas `indices`, para `cota_fraccional`.
+
+    El ahorro por euro lleva un 0 final para que, agotadas las medidas, la parte fraccional sea nula.
+    """
+    return (np.concatenate([[0.0], np.cumsum(coste[indices])]), np.concatenate([[0.0], np.cumsum(valor[indices])]),
+            np.append(valor[indices] / coste[indices], 0.0))
+
+def frontera_pareto(coste, valor, capacidad, podar, presupuesto_estados, iniciales=None):
+    """Programación dinámica sobre las medidas conservando solo los pares (coste, valor) no dominados.
+
+    Parte de los estados `iniciales` (coste, valor), por defecto solo el vacío. `podar(k, costes,
+    valores)` marca los estados que ya no pueden superar a la mejor solución conocida tras decidir
+    la medida k. Devuelve (costes, valores, historial) o None si el número de estados guardados
+    supera `presupuesto_estados`; `historial` permite reconstruir cada estado.
+    """
+    costes, valores = iniciales if iniciales is not None else (np.zeros(1), np.zeros(1))
+    historial, guardados = [], 0
+    for k in range(len(coste)):
+        caben = np.flatnonzero(costes + coste[k] <= capacidad)
+        candidatos_coste = np.concatenate([costes, costes[caben] + coste[k]])
+        candidatos_valor = np.concatenate([valores, valores[caben] + valor[k]])
+        padre = np.concatenate([np.arange(len(costes)), caben]).astype(np.int32)
+        orden = np.lexsort((-candidatos_valor, candidatos_coste))
+        candidatos_coste, candidatos_valor, padre = candidatos_coste[orden], candidatos_valor[orden], padre[orden]
+        tomada = orden >= len(costes)
+        # Un estado sobra si otro más barato (o igual de caro) ya ahorra al menos lo mismo
+        conservar = np.ones(len(orden), dtype=bool)
+        conservar[1:] = candidatos_valor[1:] > np.maximum.accumulate(candidatos_valor)[:-1]
+        conservar &= ~podar(k, candidatos_coste, candidatos_valor)
+        costes, valores = candidatos_coste[conservar], candidatos_valor[conservar]
+        historial.append((padre[conservar], tomada[conservar]))
+        guardados += len(costes)
+        if guardados > presupuesto_estados:
+            return None
+        if not len(costes):
+            break
+    return costes, valores, historial
+
+def reconstruir(historial, estado):
+    """Devuelve (medidas tomadas en `estado`, estado inicial del que parte) recorriendo el historial hacia atrás."""
+    tomadas = []
+    for k in range(len(historial) - 1, -1, -1):
+        padre, tomada = historial[k]
+        if tomada[estado]:
+            tomadas.append(k)
+        estado = padre[estado]
+    return tomadas, estado
+
+def combinar_fronteras(costes, valores, costes_g, valores_g, presupuesto, podar, presupuesto_estados):
+    """Suma cada estado de una frontera con cada estado de otra y conserva los pares no dominados.
+
+    Los pares se generan por bloques y se podan antes de guardarlos, así que la memoria depende
+    de los que sobreviven. Devuelve (costes, valores, origen, destino) o None si sobreviven más de
+    `presupuesto_estados` o hay que evaluar más de PARES_POR_ESTADO veces ese número.
+    """
+    if len(costes) * len(costes_g) > PARES_POR_ESTADO * presupuesto_estados:
+        return None
+    filas = max(1, TAMANO_BLOQUE_PARES // max(1, len(costes_g)))
+    partes = []
+    for inicio in range(0, len(costes), filas):
+        origen, destino = np.nonzero(costes[inicio:inicio + filas, None] + costes_g[None, :] <= presupuesto)
+        origen += inicio
+        suma_coste, suma_valor = costes[origen] + costes_g[destino], valores[origen] + valores_g[destino]
+        vivos = ~podar(suma_coste, suma_valor)
+        partes.append((suma_coste[vivos], suma_valor[vivos], origen[vivos], destino[vivos]))
+        if sum(len(p[0]) for p in partes) > presupuesto_estados:
+            return None
+    suma_coste, suma_valor, origen, destino = (np.concatenate(columna) for columna in zip(*partes))
+    orden = np.lexsort((-suma_valor, suma_coste))
+    conservar = np.ones(len(orden), dtype=bool)
+    conservar[1:] = suma_valor[orden][1:] > np.maximum.accumulate(suma_valor[orden])[:-1]
+    elegidos = orden[conservar]
+    return suma_coste[elegidos], suma_valor[elegidos], origen[elegidos], destino[elegidos]
+
+def resolver_exacto(coste, valor, grupo, capacidad, presupuesto, inicial, max_estados=MAX_ESTADOS):
+    """Óptimo por programación dinámica con dominancia y poda por cota, partiendo de la máscara `inicial`.
+
+    Los grupos cuyo límite puede llegar a restringir se resuelven aparte (frontera con su límite)
+    y se combinan entre sí; el resto de medidas se recorre después, una a una, sobre esa
+    frontera combinada y solo con el presupuesto total. Devuelve (máscara, óptimo demostrado,
+    estados guardados); si los estados superan `max_estados` se devuelve `inicial` sin demostrar.
+    """
+    incumbente = float(valor[inicial].sum())
+    margen = incumbente + TOLERANCIA * max(1.0, incumbente)
+    coste_grupo = np.bincount(grupo, weights=coste, minlength=len(capacidad))
+    limitados = np.flatnonzero(capacidad < np.minimum(coste_grupo, presupuesto))
+    miembros = [np.flatnonzero(grupo == g) for g in limitados]
+    libres = np.flatnonzero(~np.isin(grupo, limitados))
+    prefijos_libres = prefijos(coste, valor, libres)
+    # Lo máximo que puede aportar cada grupo limitado por sí solo (relajación lineal con su límite)
+    maximo_grupo = np.array([float(cota_fraccional(*prefijos(coste, valor, m), 0, capacidad[g])) for g, m in zip(limitados, miembros)])
+    estados = 0
+
+    def cota_fuera(prefijos_fuera, maximo, restante):
+        """Lo que pueden aportar otras medidas con `restante` euros: su relajación lineal sin límites por
+        grupo, o `maximo` (la suma de los máximos de sus grupos limitados más las libres), la menor."""
+        return np.minimum(maximo, cota_fraccional(*prefijos_fuera, 0, np.maximum(restante, 0.0)))
+
+    maximo_libres = float(prefijos_libres[1][-1])
+    fronteras = []
+    for i, (g, m) in enumerate(zip(limitados, miembros)):
+        def podar(k, costes, valores, propios=prefijos(coste, valor, m), limite=capacidad[g],
+                  fuera=prefijos(coste, valor, np.flatnonzero(grupo != g)),
+                  maximo_fuera=maximo_grupo.sum() - maximo_grupo[i] + maximo_libres):
+            resto = cota_fraccional(*propios, k + 1, np.maximum(limite - costes, 0.0))
+            return valores + resto + cota_fuera(fuera, maximo_fuera, presupuesto - costes) <= margen
+        frontera = frontera_pareto(coste[m], valor[m], capacidad[g], podar, max_estados - estados)
+        if frontera is None:
+            return inicial, False, max_estados
+        estados += sum(len(p) for p, _ in frontera[2])
+        if not len(frontera[0]):
+            return inicial, True, estados  # ningún subconjunto del grupo puede mejorar la solución inicial
+        fronteras.append(frontera)
+
+    costes, valores = (fronteras[0][0], fronteras[0][1]) if fronteras else (np.zeros(1), np.zeros(1))
+    combinaciones = []
+    for i in range(1, len(fronteras)):
+        pendientes = prefijos(coste, valor, np.flatnonzero(~np.isin(grupo, limitados[:i + 1])))
+        maximo_pendiente = maximo_grupo[i + 1:].sum() + maximo_libres
+        combinada = combinar_fronteras(
+            costes, valores, fronteras[i][0], fronteras[i][1], presupuesto,
+            lambda c, v: v + cota_fuera(pendientes, maximo_pendiente, presupuesto - c) <= margen, max_estados - estados)
+        if combinada is None:
+            return inicial, False, max_estados
+        costes, valores, origen, destino = combinada
+        combinaciones.append((origen, destino))
+        estados += len(costes)
+        if not len(costes):
+            return inicial, True, estados
+
+    def podar_libres(k, costes, valores):
+        return valores + cota_fraccional(*prefijos_libres, k + 1, np.maximum(presupuesto - costes, 0.0)) <= margen
+    final = frontera_pareto(coste[libres], valor[libres], presupuesto, podar_libres, max_estados - estados, (costes, valores))
+    if final is None:
+        return inicial, False, max_estados
+    estados += sum(len(p) for p, _ in final[2])
+    if not len(final[1]) or final[1].max() <= margen:
+        return inicial, True, estados
+
+    tomadas = np.zeros(len(coste), dtype=bool)
+    indices, estado = reconstruir(final[2], int(np.argmax(final[1])))
+    tomadas[libres[indices]] = True
+    for i in range(len(fronteras) - 1, -1, -1):
+        if i > 0:
+            estado, estado_grupo = combinaciones[i - 1][0][estado], combinaciones[i - 1][1][estado]
+        else:
+            estado_grupo = estado
+        tomadas[miembros[i][reconstruir(fronteras[i][2], estado_grupo)[0]]] = True
+    return tomadas, True, estados
+
+def mejorar_forzando(coste, valor, grupo, capacidad, presupuesto, tomadas, intentos=INTENTOS_FORZADOS):
+    """Prueba a forzar cada una de las `intentos` medidas de más ahorro que el voraz dejó fuera y
+    a completar con el voraz el resto; devuelve la mejor solución. Corrige el caso típico del voraz:
+    una medida grande y rentable que deja de caber por haber tomado antes muchas pequeñas."""
+    mejor, mejor_valor = tomadas, valor[tomadas].sum()
+    fuera = np.flatnonzero(~tomadas)
+    for j in fuera[np.argsort(-valor[fuera], kind='stable')[:intentos]].tolist():
+        resto = np.arange(len(coste)) != j
+        capacidad_resto = capacidad.copy()
+        capacidad_resto[grupo[j]] -= coste[j]
+        tomadas_resto, _ = resolver_voraz(coste[resto], valor[resto], grupo[resto], capacidad_resto, presupuesto - coste[j])
+        if valor[j] + valor[resto][tomadas_resto].sum() > mejor_valor:
+            mejor = np.zeros(len(coste), dtype=bool)
+            mejor[np.flatnonzero(resto)[tomadas_resto]] = True
+            mejor[j] = True
+            mejor_valor = valor[mejor].sum()
+    return mejor
+
+def mejorar_con_nucleo(coste, valor, grupo, capacidad, presupuesto, tomadas, nucleo=NUCLEO):
+    """Mejora la solución `tomadas` resolviendo de forma exacta solo las `nucleo` medidas dudosas.
+
+    Una medida es dudosa si su ahorro por euro está cerca del umbral a partir del cual la relajación
+    lineal deja de tomarla (el global o el de su grupo, el mayor). El resto conserva la decisión de
+    `tomadas`; así el método exacto arranca con una solución mejor y poda mucho más.
+    """
+    ratio = valor / coste
+    umbral_grupo = np.zeros(len(capacidad))
+    acumulado = np.zeros(len(capacidad))
+    umbral_global = 0.0
+    restante = presupuesto
+    for i in range(len(coste)):  # recorrido en orden de ahorro por euro: el primero que no cabe fija el umbral
+        g = grupo[i]
+        if umbral_grupo[g] == 0 and acumulado[g] + coste[i] > capacidad[g]:
+            umbral_grupo[g] = ratio[i]
+        elif umbral_grupo[g] == 0:
+            acumulado[g] += coste[i]
+            if coste[i] > restante:
+                umbral_global = ratio[i]
+                break
+            restante -= coste[i]
+    umbral = np.maximum(umbral_global, umbral_grupo[grupo])
+    if not umbral.any():
+        return tomadas
+    dudosas = np.argsort(np.abs(np.log(ratio / np.where(umbral > 0, umbral, ratio))), kind='stable')[:nucleo]
+    dudosas.sort()
+    fijas = tomadas.copy()
+    fijas[dudosas] = False
+    capacidad_nucleo = capacidad - np.bincount(grupo[fijas], weights=coste[fijas], minlength=len(capacidad))
+    mejora, _, _ = resolver_exacto(
+        coste[dudosas], valor[dudosas], grupo[dudosas], capacidad_nucleo, presupuesto - coste[fijas].sum(),
+        tomadas[dudosas], MAX_ESTADOS_NUCLEO)
+    fijas[dudosas] = mejora
+    return fijas
+
+def optimizar_cartera(df, presupuesto, objetivo='Ahorro económico', columna_limite=None, limite_por_grupo=None, metodo='Automático'):
+    """Elige las medidas de `df` que maximizan `objetivo` sin superar `presupuesto` ni los límites por grupo.
+
+    Devuelve un dict con `posiciones` (filas elegidas de `df`), el valor y la inversión de la
+    selección, la `cota_superior` del óptimo, el método usado y si el óptimo está demostrado.
+    """
+    inicio = time.perf_counter()
+    posiciones, coste, valor, grupo, capacidad = preparar_candidatas(df, objetivo, columna_limite, limite_por_grupo, presupuesto)
+    if metodo == 'Automático':
+        metodo = 'Exacto' if len(posiciones) <= LIMITE_EXACTO else 'Voraz'
+
+    tomadas, cota = resolver_voraz(coste, valor, grupo, capacidad, presupuesto)
+    optimo, estados = bool(np.all(tomadas)) or float(valor[tomadas].sum()) >= cota - TOLERANCIA * max(1.0, cota), 0
+    if metodo == 'Exacto' and not optimo:
+        tomadas = mejorar_forzando(coste, valor, grupo, capacidad, presupuesto, tomadas)
+        tomadas = mejorar_con_nucleo(coste, valor, grupo, capacidad, presupuesto, tomadas)
+        tomadas, optimo, estados = resolver_exacto(coste, valor, grupo, capacidad, presupuesto, tomadas)
+
+    sin_coste = np.flatnonzero((df['Inversión'].to_numpy() <= 0) & (df[objetivo].to_numpy() > 0))
+    elegidas = np.sort(np.concatenate([posiciones[tomadas], sin_coste]))
+    valor_total = float(df[objetivo].to_numpy(dtype=np.float64)[elegidas].sum())
+    return {
+        'posiciones': elegidas,
+        'valor': valor_total,
+        'inversion': float(coste[tomadas].sum()),
+        'cota_superior': max(valor_total, cota + float(df[objetivo].to_numpy(dtype=np.float64)[sin_coste].sum())),
+        'metodo': metodo,
+        'optimo': optimo,
+        'candidatas': len(posiciones),
+        'sin_coste': len(sin_coste),
+        'estados': estados,
+        'segundos': time.perf_counter() - inicio,
+    }
@@ -1,9 +1,30 @@
 # Importar librerías
 import streamlit as st
+from streamlit.runtime.media_file_storage import MediaFileStorageError
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
 import os
+import io
+import math
+import functools
+from analitica import (
+    columnas_categoria, huella_archivo, agrupar_por_año, importes_float64,
+    clasificar_continuidad, ultima_auditoria, construir_cubo, indicadores_resumen, filtrar_auditoria,
+    tabla_explicacion, orden_filas, exportar_csv, exportar_excel, MAX_FILAS_EXCEL
+)
+from almacen_datos import (
+    nuevo_almacen, presupuesto_por_entorno, obtener_auditoria, obtener_indice, obtener_multianual, estadisticas_almacen
+)
+from diagnostico import nuevo_registro, medir_etapa, modo_diagnostico, diagnostico_por_entorno, ruta_log_por_entorno
+from graficos import (
+    figura_recuento, figura_ahorro_energetico, figura_ahorro_economico, figura_inversion_ahorro,
+    figura_eficacia_inversion, figura_periodo_retorno, figura_sankey, figura_mapa, figura_bandas_escenarios,
+    METRICAS_MAPA, MODOS_DISPERSION, METRICAS_BANDAS
+)
+from escenarios import COLUMNA_AHORRO, PORTADORES, PARAMETROS_ESCENARIO, simular_escenarios, simulaciones_efectivas
+from mapa import TOLERANCIAS, cargar_geometrias, codigos_comunidad
+from optimizacion import OBJETIVOS, METODOS, optimizar_cartera
 
 # Configuración de la página
 st.set_page_config(
@@ -13,25 +34,69 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Instrumentación opcional por etapas (ASEPEYO_DIAGNOSTICO=1 o ?diagnostico=1; =memoria para el pico de memoria)
+modo_diagnostico_activo = diagnostico_por_entorno() or modo_diagnostico(st.query_params.get('diagnostico'))
+if modo_diagnostico_activo:
+    registro_diagnostico = nuevo_registro(ruta_log_por_entorno(), memoria=modo_diagnostico_activo == 'memoria')
+else:
+    registro_diagnostico = None
+MAX_REEJECUCIONES_DIAGNOSTICO = 20
+
+def registro_actual():
+    """Registro en el que anotar las etapas: el de la ejecución completa o, si solo se vuelve a
+    ejecutar un panel (fragmento), el de esa reejecución."""
+    if registro_diagnostico is None:
+        return None
+    ctx = get_script_run_ctx()
+    if ctx is not None and ctx.fragment_ids_this_run:
+        return st.session_state.get('registro_fragmento', registro_diagnostico)
+    return registro_diagnostico
+
+def fragmento(panel):
+    """`st.fragment` cuyas reejecuciones propias se miden en un registro aparte.
+
+    La ejecución completa no vuelve a pintar el panel de diagnóstico cuando solo se reejecuta un
+    panel: con el diagnóstico activo, el panel muestra al final sus propias etapas y la
+    reejecución se guarda para el panel de diagnóstico de la siguiente ejecución completa.
+    """
+    @st.fragment
+    @functools.wraps(panel)
+    def ejecutar(*args, **kwargs):
+        ctx = get_script_run_ctx()
+        if registro_diagnostico is None or ctx is None or not ctx.fragment_ids_this_run:
+            return panel(*args, **kwargs)
+        registro = nuevo_registro(registro_diagnostico['ruta_log'], registro_diagnostico['memoria'], panel.__name__)
+        st.session_state.registro_fragmento = registro
+        panel(*args, **kwargs)
+        reejecuciones = st.session_state.setdefault('reejecuciones_diagnostico', [])
+        reejecuciones.append(registro)
+        del reejecuciones[:-MAX_REEJECUCIONES_DIAGNOSTICO]
+        if registro['etapas']:
+            st.caption("Diagnóstico de esta reejecución del panel: " + ", ".join(
+                f"{e['etapa']} {e['pico_mb']:.2f} MB" if registro['memoria'] else f"{e['etapa']} {e['segundos']:.4f} s"
+                for e in registro['etapas']
+            ))
+    return ejecutar
+
 # --- Carga y Cacheo de Datos ---
 @st.cache_data
-def load_data(file_path):
-    """Carga, limpia y procesa los datos de la auditoría energética."""
+def listar_auditorias(data_dir, mtime_directorio):
+    """Lista los CSV de `data_dir`; `mtime_directorio` hace que se vuelva a listar solo si cambia la carpeta."""
+    return [f for f in os.listdir(data_dir) if f.endswith('.csv')]
+
+@st.cache_resource
+def almacen_auditorias():
+    """Almacén de auditorías del proceso, con presupuesto de memoria y desalojo LRU."""
+    return nuevo_almacen(presupuesto_por_entorno())
+
+def load_data(file_path, huella):
+    """Carga, limpia y procesa los datos de la auditoría energética.
+
+    Los datos se comparten entre sesiones desde el almacén (sin copias por sesión); una
+    `huella` distinta de la guardada hace que el CSV modificado se vuelva a cargar.
+    """
     try:
-        df = pd.read_csv(file_path)
-        df.columns = df.columns.str.strip()
-        # Unifica el renombrado para manejar tanto CSVs en inglés como en español
-        df.rename(columns={
-            'Center': 'Centro', 'Measure': 'Medida',
-            'Energy Saved': 'Ahorro energético', 'Money Saved': 'Ahorro económico',
-            'Investment': 'Inversión', 'Pay back period': 'Periodo de retorno',
-            'Energía Ahorrada (kWh/año)': 'Ahorro energético', 'Dinero Ahorrado (€/año)': 'Ahorro económico',
-            'Inversión (€)': 'Inversión', 'Periodo de Amortización (años)': 'Periodo de retorno'
-        }, inplace=True)
-        for col in ['Ahorro energético', 'Ahorro económico', 'Inversión', 'Periodo de retorno']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.fillna(0, inplace=True)
-        return df
+        return obtener_auditoria(almacen_auditorias(), file_path, huella)
     except FileNotFoundError:
         st.error(f"Error: No se encontró el archivo de datos en la ruta: {file_path}")
         return pd.DataFrame()
@@ -39,6 +104,231 @@ def load_data(file_path):
         st.error(f"Error de columna: No se encontró la columna requerida. Revise el CSV (columna faltante: {e})")
         return pd.DataFrame()
 
+def indice_filtros(file_path, huella):
+    """Índice de filtros de una auditoría, compartido (solo lectura) entre sesiones y guardado con sus datos."""
+    return obtener_indice(almacen_auditorias(), file_path, huella)
+
+# --- Paneles del Dashboard ---
+def cabecera(titulo):
+    """Logo de la página (o su nombre si no se encuentra la imagen) y título."""
+    try:
+        st.image("Logo_ASEPEYO.png", width=250)
+    except MediaFileStorageError:
+        st.write("## ASEPEYO Dashboard")
+    st.title(titulo)
+
+MAX_FIGURAS_EN_CACHE = 32
+
+def figura_en_cache(clave, construir, datos, **opciones):
+    """Devuelve la figura ya construida para `clave` en esta sesión o la construye una vez."""
+    figuras = st.session_state.setdefault('figuras', {})
+    if clave not in figuras:
+        while len(figuras) >= MAX_FIGURAS_EN_CACHE:
+            figuras.pop(next(iter(figuras)))  # la más antigua
+        with medir_etapa(registro_actual(), f"figura:{construir.__name__}", len(datos)):
+            figuras[clave] = construir(datos, **opciones)
+    return figuras[clave]
+
+@fragmento
+def panel_grafico(titulo, construir, datos, clave_datos, porcentaje_global, mensaje_vacio=None, modos=None, **opciones):
+    """Panel independiente: sus controles solo vuelven a ejecutar (y reenviar) este gráfico.
+
+    `porcentaje_global` es el valor del interruptor de la barra lateral (None si el gráfico
+    no tiene vista en porcentaje); el interruptor del panel parte de él y se reinicia al cambiarlo.
+    Con `modos`, el panel añade un selector de representación que se pasa como `modo`.
+    """
+    st.subheader(titulo)
+    if porcentaje_global is not None:
+        opciones['mostrar_porcentaje'] = st.toggle(
+            'Ver en porcentaje', value=porcentaje_global, key=f"porcentaje_{construir.__name__}_{porcentaje_global}"
+        )
+    if modos:
+        opciones['modo'] = st.radio('Representación', modos, horizontal=True, key=f"modo_{construir.__name__}")
+    clave = (construir.__name__, clave_datos, tuple(sorted(opciones.items())))
+    fig = figura_en_cache(clave, construir, datos, **opciones)
+    if fig is not None:
+        with medir_etapa(registro_actual(), f"envio:{construir.__name__}"):
+            st.plotly_chart(fig, use_container_width=True)
+    elif mensaje_vacio:
+        st.info(mensaje_vacio)
+
+@st.cache_resource
+def geometrias_comunidades(ruta_geojson, huella):
+    """Geometrías simplificadas por nivel de detalle, cargadas una vez y compartidas entre sesiones."""
+    return cargar_geometrias(ruta_geojson)
+
+@fragmento
+def panel_mapa(df_filtrado, clave_datos, ruta_geojson):
+    """Mapa coroplético por comunidad; cambiar la métrica o el detalle solo vuelve a ejecutar este panel."""
+    st.subheader("Mapa por Comunidad Autónoma")
+    col_metrica, col_detalle = st.columns(2)
+    metrica = col_metrica.selectbox("Métrica del mapa", list(METRICAS_MAPA), key='metrica_mapa')
+    nivel = col_detalle.selectbox("Nivel de detalle", list(TOLERANCIAS), key='detalle_mapa')
+    geojson = geometrias_comunidades(ruta_geojson, huella_archivo(ruta_geojson))[nivel]
+    fig = figura_en_cache(('figura_mapa', clave_datos, metrica, nivel), figura_mapa, df_filtrado, geojson=geojson, metrica=metrica)
+    if fig is not None:
+        with medir_etapa(registro_actual(), "envio:figura_mapa"):
+            st.plotly_chart(fig, use_container_width=True)
+    sin_geometria = [nombre for nombre, codigo in codigos_comunidad(df_filtrado['Comunidad Autónoma'].unique(), geojson).items() if codigo is None]
+    if sin_geometria:
+        st.caption(f"Comunidades sin polígono en el mapa: {', '.join(sorted(sin_geometria))}")
+
+@fragmento
+def panel_escenarios(df_filtrado, columna_agrupar, clave_datos, columna_ahorro):
+    """Bandas Monte Carlo del retorno y del ROI; cambiar los supuestos solo vuelve a ejecutar este panel."""
+    st.subheader("Incertidumbre de Precios y Ahorros (Simulación Monte Carlo)")
+    with st.expander("Supuestos del escenario"):
+        col_general, *col_portadores = st.columns(1 + len(PORTADORES))
+        horizonte = col_general.slider("Horizonte (años)", 5, 30, PARAMETROS_ESCENARIO['horizonte'], key='horizonte_escenarios')
+        simulaciones = col_general.select_slider("Simulaciones", [500, 1000, 2000, 5000],
+                                                 value=PARAMETROS_ESCENARIO['simulaciones'], key='simulaciones_escenarios')
+        dispersion = col_general.slider("Dispersión de cada medida (%)", 0, 100,
+                                        round(PARAMETROS_ESCENARIO['dispersion_medida'] * 100), key='dispersion_escenarios')
+        precios = {}
+        for portador, columna in zip(PORTADORES, col_portadores):
+            tendencia, volatilidad = PARAMETROS_ESCENARIO['precios'][portador]
+            precios[portador] = (
+                columna.slider(f"Tendencia del precio: {portador} (%/año)", -5.0, 10.0, tendencia * 100, 0.5,
+                               key=f'tendencia_{portador}') / 100,
+                columna.slider(f"Volatilidad del precio: {portador} (%)", 0, 50, round(volatilidad * 100),
+                               key=f'volatilidad_{portador}') / 100,
+            )
+        realizacion = {}
+        columnas_realizacion = st.columns(len(PARAMETROS_ESCENARIO['realizacion']))
+        for (categoria, (media, desviacion)), columna in zip(PARAMETROS_ESCENARIO['realizacion'].items(), columnas_realizacion):
+            realizacion[categoria] = (
+                columna.slider(f"Realización media: {categoria} (%)", 10, 120, round(media * 100), key=f'realizacion_{categoria}') / 100,
+                desviacion,
+            )
+    parametros = {'horizonte': horizonte, 'simulaciones': simulaciones, 'precios': precios,
+                  'realizacion': realizacion, 'dispersion_medida': dispersion / 100}
+    metrica = st.radio("Métrica", list(METRICAS_BANDAS), horizontal=True, key='metrica_escenarios')
+
+    clave_escenarios = (clave_datos, repr(parametros))
+    if st.session_state.get('clave_escenarios') != clave_escenarios:
+        with medir_etapa(registro_actual(), 'escenarios', len(df_filtrado)) as etapa:
+            st.session_state.bandas_escenarios = simular_escenarios(df_filtrado, columna_agrupar, parametros,
+                                                                    columna_ahorro=columna_ahorro)
+            st.session_state.clave_escenarios = clave_escenarios
+            etapa['filas_salida'] = len(st.session_state.bandas_escenarios)
+    bandas = st.session_state.bandas_escenarios
+
+    fig = figura_bandas_escenarios(bandas, columna_agrupar, metrica, horizonte)
+    if fig is not None:
+        with medir_etapa(registro_actual(), "envio:figura_bandas_escenarios"):
+            st.plotly_chart(fig, use_container_width=True)
+    grupos = len(bandas) - 1
+    usadas = simulaciones_efectivas(grupos, simulaciones)
+    st.caption(f"Retornos no alcanzados en {horizonte} años se muestran en el horizonte. "
+               "El ahorro auditado se toma como el del primer año a precios actuales."
+               + (f" Con {grupos:,} grupos se ejecutan {usadas:,} simulaciones para acotar el tiempo de cálculo." if usadas < simulaciones else ""))
+    formato = {columna: st.column_config.NumberColumn(format="%.2f") for columna in bandas.columns[3:]}
+    st.dataframe(bandas, use_container_width=True, hide_index=True, column_config={
+        'Inversión': st.column_config.NumberColumn(format="€ %.0f"),
+        'Ahorro auditado': st.column_config.NumberColumn(format="€ %.0f"),
+        **formato,
+    })
+
+@st.cache_data
+def explicacion_categorias(tipo_analisis, categorias):
+    return tabla_explicacion(tipo_analisis, categorias)
+
+FORMATO_COLUMNAS_DETALLE = {
+    "Inversión": st.column_config.NumberColumn("Inversión (€)", format="€ %d"),
+    "Ahorro energético": st.column_config.NumberColumn("Ahorro Energético (kWh)", format="%d kWh"),
+    "Ahorro económico": st.column_config.NumberColumn("Ahorro Anual (€)", format="€ %d"),
+    "Periodo de retorno": st.column_config.NumberColumn("Retorno (años)", format="%.1f años"),
+}
+
+def exportacion_diferida(exportar, df, posiciones, columnas):
+    """Callable para st.download_button: el fichero solo se genera, por bloques, al pulsar el botón."""
+    def generar():
+        destino = io.BytesIO()
+        exportar(df, posiciones, columnas, destino)
+        destino.seek(0)
+        return destino
+    return generar
+
+@fragmento
+def panel_tabla_detalle(df_filtrado, columnas, columna_agrupar, clave_datos, nombre_base, titulo=None):
+    """Tabla paginada: se ordenan posiciones de fila y solo se envía al navegador la página visible."""
+    st.subheader(titulo or f"2. Datos Detallados por {columna_agrupar}")
+    col_orden, col_sentido, col_tamano, col_pagina = st.columns([0.35, 0.2, 0.2, 0.25])
+    columna_orden = col_orden.selectbox("Ordenar por", columnas, key="columna_orden_detalle")
+    ascendente = col_sentido.toggle("Ascendente", value=True, key="ascendente_detalle")
+    filas_por_pagina = col_tamano.selectbox("Filas por página", [50, 100, 500, 1000], index=1, key="filas_por_pagina_detalle")
+
+    # Solo se guarda la última ordenación: al cambiar filtros u orden se sustituye
+    clave_orden = (clave_datos, columna_orden, ascendente)
+    if st.session_state.get('clave_orden_detalle') != clave_orden:
+        st.session_state.orden_detalle = orden_filas(df_filtrado, columna_orden, ascendente)
+        st.session_state.clave_orden_detalle = clave_orden
+    posiciones = st.session_state.orden_detalle
+
+    total_paginas = max(1, math.ceil(len(posiciones) / filas_por_pagina))
+    # La página sí depende de los datos: con otros filtros se vuelve a la primera
+    sufijo = abs(hash(clave_datos))
+    pagina = col_pagina.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1,
+                                     key=f"pagina_detalle_{sufijo}_{filas_por_pagina}")
+    inicio = (pagina - 1) * filas_por_pagina
+    df_pagina = df_filtrado.take(posiciones[inicio:inicio + filas_por_pagina])[columnas]
+    with medir_etapa(registro_actual(), 'tabla:detalle', len(df_pagina)):
+        st.dataframe(df_pagina, use_container_width=True, hide_index=True, column_config=FORMATO_COLUMNAS_DETALLE)
+    st.caption(f"Filas {inicio + 1:,}–{inicio + len(df_pagina):,} de {len(posiciones):,}")
+
+    col_csv, col_excel = st.columns(2)
+    col_csv.download_button(
+        "Descargar CSV", exportacion_diferida(exportar_csv, df_filtrado, posiciones, columnas),
+        file_name=f"{nombre_base}.csv", mime="text/csv", on_click="ignore", use_container_width=True
+    )
+    # Una hoja de Excel admite MAX_FILAS_EXCEL filas contando la cabecera
+    cabe_en_excel = len(posiciones) < MAX_FILAS_EXCEL
+    col_excel.download_button(
+        "Descargar Excel", exportacion_diferida(exportar_excel, df_filtrado, posiciones, columnas) if cabe_en_excel else b"",
+        file_name=f"{nombre_base}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore", use_container_width=True, disabled=not cabe_en_excel
+    )
+    if not cabe_en_excel:
+        col_excel.caption(f"Excel admite como máximo {MAX_FILAS_EXCEL - 1:,} filas: descargue la selección en CSV.")
+
+def mostrar_diagnostico():
+    """Panel plegable con las etapas medidas en esta ejecución (solo si el diagnóstico está activo)."""
+    if registro_diagnostico is None:
+        return
+    with st.expander("Diagnóstico de rendimiento"):
+        almacen = estadisticas_almacen(almacen_auditorias())
+        st.caption(
+            f"Almacén de auditorías: {almacen['auditorias']} en memoria, {almacen['memoria_mb']:.1f} de "
+            f"{almacen['presupuesto_mb']:.0f} MB; {almacen['aciertos']} aciertos, {almacen['fallos']} fallos, "
+            f"{almacen['desalojos']} desalojos, {almacen['invalidaciones']} invalidaciones"
+        )
+        etapas = pd.DataFrame(registro_diagnostico['etapas'])
+        if etapas.empty:
+            st.write("No se han medido etapas en esta ejecución.")
+        else:
+            total = (f"pico de memoria máximo {etapas['pico_mb'].max():.2f} MB" if registro_diagnostico['memoria']
+                     else f"{etapas['segundos'].sum():.3f} s en etapas medidas")
+            st.caption(f"Ejecución {registro_diagnostico['ejecucion']}: {total}")
+            tabla_etapas(etapas, registro_diagnostico['memoria'])
+        reejecuciones = [
+            {**etapa, 'panel': registro['origen'], 'ejecucion': registro['ejecucion']}
+            for registro in st.session_state.get('reejecuciones_diagnostico', []) for etapa in registro['etapas']
+        ]
+        if reejecuciones:
+            st.caption(f"Reejecuciones de paneles desde la ejecución completa anterior (últimas {MAX_REEJECUCIONES_DIAGNOSTICO})")
+            tabla_etapas(pd.DataFrame(reejecuciones), registro_diagnostico['memoria'])
+        st.session_state.reejecuciones_diagnostico = []
+
+def tabla_etapas(etapas, memoria):
+    """Etapas medidas, solo con la columna de la pasada (tiempo o pico de memoria)."""
+    st.dataframe(
+        etapas.drop(columns='segundos' if memoria else 'pico_mb'), use_container_width=True, hide_index=True,
+        column_config={
+            "segundos": st.column_config.NumberColumn("Tiempo (s)", format="%.4f"),
+            "pico_mb": st.column_config.NumberColumn("Pico memoria (MB)", format="%.2f"),
+        }
+    )
+
 # --- Barra Lateral y Lógica de Carga de Datos ---
 with st.sidebar:
     st.title('⚡ Filtros de análisis')
@@ -48,22 +338,66 @@ with st.sidebar:
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR) # Crear carpeta si no existe para evitar crash inicial
             
-        files = [f for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+        files = listar_auditorias(DATA_DIR, os.stat(DATA_DIR).st_mtime_ns)
         if not files:
             st.warning("No se encontraron archivos CSV en la carpeta 'Data/'.")
             st.stop()
-        
-        selected_file = st.selectbox(
-            "Seleccionar Auditoría", files,
-            index=files.index("2025 Energy Audit summary - Sheet1.csv") if "2025 Energy Audit summary - Sheet1.csv" in files else 0
-        )
-        file_path = os.path.join(DATA_DIR, selected_file)
-        df_original = load_data(file_path)
+
+        modo_vista = st.radio("Modo de Vista", ('Auditoría individual', 'Comparación multianual', 'Optimización de inversiones'), horizontal=True)
+
+        if modo_vista != 'Auditoría individual':
+            archivos_por_año = agrupar_por_año(files)
+            minimo_años = 2 if modo_vista == 'Comparación multianual' else 1
+            if len(archivos_por_año) < minimo_años:
+                if minimo_años == 2:
+                    st.warning("Se necesitan auditorías de al menos dos años distintos (el año debe figurar en el nombre del CSV).")
+                else:
+                    st.warning("No hay auditorías con el año en el nombre del CSV.")
+                st.stop()
+            años_disponibles = list(archivos_por_año)
+            años_seleccionados = st.multiselect("Seleccionar Años", años_disponibles, default=años_disponibles[-minimo_años:])
+            # Solo se materializan las particiones de los años elegidos
+            rutas_seleccionadas = [(año, os.path.join(DATA_DIR, f)) for año in sorted(años_seleccionados) for f in archivos_por_año[año]]
+            with medir_etapa(registro_actual(), 'carga_multianual') as etapa:
+                # Compartido y reutilizado mientras no cambien los años elegidos ni sus CSV
+                df_multianual = obtener_multianual(almacen_auditorias(), rutas_seleccionadas, load_data)
+                etapa['filas_salida'] = len(df_multianual)
+        else:
+            selected_file = st.selectbox(
+                "Seleccionar Auditoría", files,
+                index=files.index("2025 Energy Audit summary - Sheet1.csv") if "2025 Energy Audit summary - Sheet1.csv" in files else 0
+            )
+            file_path = os.path.join(DATA_DIR, selected_file)
+            with medir_etapa(registro_actual(), 'carga') as etapa:
+                df_original = load_data(file_path, huella_archivo(file_path))
+                etapa['filas_salida'] = len(df_original)
+            if not df_original.empty:
+                with medir_etapa(registro_actual(), 'indice_filtros', len(df_original)):
+                    indice = indice_filtros(file_path, huella_archivo(file_path))
     except FileNotFoundError:
         st.error(f"El directorio '{DATA_DIR}' no fue encontrado.")
         st.stop()
 
-    if not df_original.empty:
+    if modo_vista != 'Auditoría individual':
+        if not df_multianual.empty:
+            comunidades_multianual = st.multiselect(
+                'Seleccionar Comunidades', df_multianual['Comunidad Autónoma'].cat.categories.tolist(),
+                default=df_multianual['Comunidad Autónoma'].cat.categories.tolist()
+            )
+        if modo_vista == 'Optimización de inversiones' and not df_multianual.empty:
+            st.markdown("---")
+            objetivo_optimizacion = st.radio("Maximizar", list(OBJETIVOS))
+            presupuesto = st.number_input(
+                "Presupuesto (€)", min_value=0.0, step=1000.0,
+                value=float(round(df_multianual['Inversión'].astype('float64').sum() * 0.25, -3))
+            )
+            limitar_por = st.selectbox("Limitar la inversión por", ['Sin límite', 'Comunidad Autónoma', *columnas_categoria.values()])
+            limite_porcentaje = None
+            if limitar_por != 'Sin límite':
+                limite_porcentaje = st.slider("Máximo por grupo (% del presupuesto)", 5, 100, 30, step=5)
+            metodo_optimizacion = st.radio("Método", METODOS, horizontal=True,
+                                           help="Automático usa el método exacto hasta varios miles de medidas candidatas y el voraz a partir de ahí.")
+    elif not df_original.empty:
         tipo_analisis = st.radio(
             "Seleccionar Tipo de Análisis",
             ('Tipo de Medida', 'Tipo de Intervención', 'Impacto Financiero', 'Tipo de sistema', 'Tipo de Ahorro Energético')
@@ -92,7 +426,7 @@ with st.sidebar:
         
         # --- NUEVO CÓDIGO: Filtro por Medidas Específicas ---
         st.write("**Filtro por Medidas**")
-        todas_medidas = sorted(df_original['Medida'].unique().tolist())
+        todas_medidas = df_original['Medida'].cat.categories.tolist()
         medidas_seleccionadas_filtro = st.multiselect(
             "Incluir medidas específicas:",
             options=todas_medidas,
@@ -106,10 +440,10 @@ with st.sidebar:
 
         if 'last_file' not in st.session_state or st.session_state.last_file != selected_file:
             st.session_state.last_file = selected_file
-            st.session_state.comunidades_seleccionadas = sorted(df_original['Comunidad Autónoma'].unique().tolist())
+            st.session_state.comunidades_seleccionadas = df_original['Comunidad Autónoma'].cat.categories.tolist()
             st.session_state.centros_seleccionados = []
         
-        lista_comunidades = sorted(df_original['Comunidad Autónoma'].unique().tolist())
+        lista_comunidades = df_original['Comunidad Autónoma'].cat.categories.tolist()
         if st.button("Todas las Comunidades", use_container_width=True):
             st.session_state.comunidades_seleccionadas = lista_comunidades
         
@@ -118,7 +452,9 @@ with st.sidebar:
 
         if vista_detallada:
             if comunidades_seleccionadas:
-                centros_disponibles = sorted(df_original[df_original['Comunidad Autónoma'].isin(comunidades_seleccionadas)]['Centro'].unique().tolist())
+                centros_disponibles = sorted({
+                    centro for comunidad in comunidades_seleccionadas for centro in indice['centros_por_comunidad'].get(comunidad, [])
+                })
                 if not all(centro in centros_disponibles for centro in st.session_state.centros_seleccionados):
                     st.session_state.centros_seleccionados = centros_disponibles
                 
@@ -136,128 +472,172 @@ with st.sidebar:
         else:
             centros_seleccionados = []
 
+# --- Modo de Comparación Multianual ---
+if modo_vista == 'Comparación multianual':
+    cabecera("Comparación Multianual de Auditorías")
+
+    if len(años_seleccionados) < 2:
+        st.info("Seleccione al menos dos años para comparar.")
+        st.stop()
+    df_comparacion = df_multianual[df_multianual['Comunidad Autónoma'].isin(comunidades_multianual)]
+    if df_comparacion.empty:
+        st.info("No hay datos disponibles para la selección de filtros actual.")
+        st.stop()
+
+    año_base, año_comparado = min(años_seleccionados), max(años_seleccionados)
+    st.header(f"{año_base} frente a {año_comparado}")
+
+    kpis_año = importes_float64(df_comparacion).groupby('Año').agg(
+        Inversion_Total=('Inversión', 'sum'),
+        Ahorro_Total_Economico=('Ahorro económico', 'sum'),
+        Ahorro_Total_Energia=('Ahorro energético', 'sum'),
+        Recuento_Medidas=('Medida', 'size')
+    ).reindex(sorted(años_seleccionados), fill_value=0)
+    kpis_año['ROI'] = (kpis_año['Ahorro_Total_Economico'] / kpis_año['Inversion_Total'].where(kpis_año['Inversion_Total'] > 0)).fillna(0) * 100
+    actual, anterior = kpis_año.loc[año_comparado], kpis_año.loc[año_base]
+
+    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+    kpi1.metric(label=f"Inversión Total {año_comparado}", value=f"€ {actual['Inversion_Total']:,.0f}",
+                delta=f"{actual['Inversion_Total'] - anterior['Inversion_Total']:+,.0f} €")
+    kpi2.metric(label=f"Ahorro Económico Total {año_comparado}", value=f"€ {actual['Ahorro_Total_Economico']:,.0f}",
+                delta=f"{actual['Ahorro_Total_Economico'] - anterior['Ahorro_Total_Economico']:+,.0f} €")
+    kpi3.metric(label=f"Ahorro Energético Total {año_comparado}", value=f"{actual['Ahorro_Total_Energia']:,.0f} kWh",
+                delta=f"{actual['Ahorro_Total_Energia'] - anterior['Ahorro_Total_Energia']:+,.0f} kWh")
+    kpi4.metric(label=f"Retorno de la Inversión {año_comparado}", value=f"{actual['ROI']:.2f} %",
+                delta=f"{actual['ROI'] - anterior['ROI']:+.2f} pp")
+    st.markdown("---")
+
+    col1, col2 = st.columns(2, gap="large")
+
+    with col1:
+        st.subheader("Evolución del Ahorro Económico por Comunidad")
+        tendencia = importes_float64(df_comparacion).groupby(['Año', 'Comunidad Autónoma'], observed=True).agg(
+            Ahorro_Total_Economico=('Ahorro económico', 'sum')
+        ).reset_index()
+        tendencia['Año'] = tendencia['Año'].astype(str)
+        fig_tendencia = px.line(
+            tendencia, x='Año', y='Ahorro_Total_Economico', color='Comunidad Autónoma', markers=True,
+            title='Ahorro Económico por Año y Comunidad'
+        )
+        fig_tendencia.update_layout(yaxis_title="Ahorro Anual (€)", xaxis_title="Año de Auditoría", template="plotly_white")
+        st.plotly_chart(fig_tendencia, use_container_width=True)
+
+    continuidad = clasificar_continuidad(df_comparacion, año_base, año_comparado)
+
+    with col2:
+        st.subheader(f"Continuidad de Medidas {año_base} → {año_comparado}")
+        recuento_continuidad = continuidad.groupby(['Comunidad Autónoma', 'Estado'], observed=True).size().reset_index(name='Recuento')
+        fig_continuidad = px.bar(
+            recuento_continuidad, x='Comunidad Autónoma', y='Recuento', color='Estado',
+            title='Medidas Mantenidas, Eliminadas y Nuevas por Comunidad',
+            color_discrete_map={'Mantenida': '#2ca02c', 'Eliminada': '#d62728', 'Nueva': '#1f77b4'}
+        )
+        fig_continuidad.update_layout(yaxis_title="Número de Medidas (Centro, Medida)", template="plotly_white")
+        st.plotly_chart(fig_continuidad, use_container_width=True)
+
+    st.subheader("Detalle de Medidas por Estado")
+    st.dataframe(
+        continuidad.sort_values(['Estado', 'Comunidad Autónoma', 'Centro']),
+        use_container_width=True, hide_index=True
+    )
+    mostrar_diagnostico()
+    st.stop()
+
+# --- Modo de Optimización de Inversiones ---
+if modo_vista == 'Optimización de inversiones':
+    cabecera("Optimización de Inversiones")
+    if df_multianual.empty:
+        st.info("Seleccione al menos un año.")
+        st.stop()
+    df_seleccion = df_multianual[df_multianual['Comunidad Autónoma'].isin(comunidades_multianual)]
+    # Una medida auditada en varios años se financia una sola vez, con los datos de su auditoría más reciente
+    df_candidatas = ultima_auditoria(df_seleccion).reset_index(drop=True)
+    sustituidas = len(df_seleccion) - len(df_candidatas)
+    if df_candidatas.empty:
+        st.info("No hay datos disponibles para la selección de filtros actual.")
+        st.stop()
+
+    columna_limite = None if limitar_por == 'Sin límite' else limitar_por
+    limite_por_grupo = None if columna_limite is None else presupuesto * limite_porcentaje / 100
+    # Como el cubo: la cartera solo se recalcula cuando cambian los datos o los parámetros
+    clave_cartera = (
+        tuple((año, ruta, huella_archivo(ruta)) for año, ruta in rutas_seleccionadas), tuple(comunidades_multianual),
+        objetivo_optimizacion, presupuesto, columna_limite, limite_por_grupo, metodo_optimizacion
+    )
+    if st.session_state.get('clave_cartera') != clave_cartera:
+        with medir_etapa(registro_actual(), 'optimizacion', len(df_candidatas)) as etapa:
+            st.session_state.cartera = optimizar_cartera(
+                df_candidatas, presupuesto, objetivo_optimizacion, columna_limite, limite_por_grupo, metodo_optimizacion)
+            etapa['filas_salida'] = len(st.session_state.cartera['posiciones'])
+        st.session_state.clave_cartera = clave_cartera
+    cartera = st.session_state.cartera
+    unidad = OBJETIVOS[objetivo_optimizacion]
+
+    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+    kpi1.metric(label="Inversión Asignada", value=f"€ {cartera['inversion']:,.0f}",
+                delta=f"{cartera['inversion'] / presupuesto * 100:.1f} % del presupuesto" if presupuesto > 0 else None, delta_color="off")
+    kpi2.metric(label=f"{objetivo_optimizacion} Anual", value=f"{cartera['valor']:,.0f} {unidad}")
+    kpi3.metric(label="Medidas Seleccionadas", value=f"{len(cartera['posiciones']):,}",
+                delta=f"{cartera['sin_coste']:,} sin coste", delta_color="off")
+    distancia = (cartera['cota_superior'] - cartera['valor']) / cartera['cota_superior'] * 100 if cartera['cota_superior'] > 0 else 0
+    kpi4.metric(label="Distancia Máxima al Óptimo", value="Óptimo" if cartera['optimo'] else f"≤ {distancia:.3f} %")
+    st.caption(f"Método {cartera['metodo'].lower()}: {cartera['candidatas']:,} medidas candidatas con inversión, "
+               f"resuelto en {cartera['segundos']:.2f} s."
+               + (f" Se han descartado {sustituidas:,} filas de medidas con una auditoría posterior." if sustituidas else ""))
+    st.markdown("---")
+
+    df_cartera = df_candidatas.take(cartera['posiciones']).rename(columns={columnas_categoria['Tipo de Medida']: 'Categoría'})
+    if df_cartera.empty:
+        st.info("Ninguna medida cabe en el presupuesto indicado.")
+        st.stop()
+
+    st.subheader("Inversión Asignada por Comunidad")
+    reparto = importes_float64(df_cartera).groupby(['Comunidad Autónoma', 'Categoría'], observed=True).agg(
+        Inversion_Total=('Inversión', 'sum'), Ahorro_Total=(objetivo_optimizacion, 'sum'), Recuento=('Medida', 'size')
+    ).reset_index()
+    fig_reparto = px.bar(
+        reparto, x='Comunidad Autónoma', y='Inversion_Total', color='Categoría', hover_data=['Ahorro_Total', 'Recuento'],
+        title=f'Cartera que maximiza el {objetivo_optimizacion.lower()} con € {presupuesto:,.0f}'
+    )
+    fig_reparto.update_layout(yaxis_title="Inversión (€)", legend_title='Tipo de Medida', template="plotly_white")
+    st.plotly_chart(fig_reparto, use_container_width=True)
+
+    columnas_cartera = ['Año', 'Comunidad Autónoma', 'Centro', 'Medida', 'Categoría', 'Inversión', 'Ahorro energético', 'Ahorro económico', 'Periodo de retorno']
+    panel_tabla_detalle(df_cartera, columnas_cartera, 'Comunidad Autónoma', clave_cartera, "cartera_optima",
+                        titulo="Medidas Seleccionadas")
+    mostrar_diagnostico()
+    st.stop()
+
 # --- Lógica de la Aplicación Principal ---
 if 'df_original' in locals() and not df_original.empty:
     
-    mapeo_medidas = {
-        "Regulación de la temperatura de consigna": {"Category": "Medidas de control térmico", "Code": "A.1"},
-        "Sustitución de equipos de climatización": {"Category": "Medidas de control térmico", "Code": "A.2"},
-        "Instalación cortina de aire": {"Category": "Medidas de control térmico", "Code": "A.3"},
-        "Instalación de temporizador digital": {"Category": "Medidas de control térmico", "Code": "A.4"},
-        "Regulación de ventilación mediante sonda de CO2": {"Category": "Medidas de control térmico", "Code": "A.5"},
-        "Recuperadores de calor": {"Category": "Medidas de control térmico", "Code": "A.6"},
-        "Ajuste O2 en caldera gasóleo C": {"Category": "Medidas de control térmico", "Code": "A.7"},
-        "Instalación de Variadores de frecuencia en bombas hidráulicas": {"Category": "Medidas de control térmico", "Code": "A.8"},
-        "Instalación Solar térmica": {"Category": "Medidas de control térmico", "Code": "A.9"},
-        "Aislamiento Térmico de Tuberías y Redes": {"Category": "Medidas de control térmico", "Code": "A.10"},
-        "Mejora de la Eficiencia en Calderas": {"Category": "Medidas de control térmico", "Code": "A.11"},
-        "Optimización de la potencia contratada": {"Category": "Medidas de gestión energética", "Code": "B.1"},
-        "Sistema de Gestión Energética": {"Category": "Medidas de gestión energética", "Code": "B.2"},
-        "Eliminación de la energía reactiva": {"Category": "Medidas de gestión energética", "Code": "B.3"},
-        "Reducción del consumo remanente": {"Category": "Medidas de gestión energética", "Code": "B.4"},
-        "Promover la cultura energética": {"Category": "Medidas de gestión energética", "Code": "B.5"},
-        "Instalación Fotovoltaica": {"Category": "Medidas de gestión energética", "Code": "B.6"},
-        "Instalación de Paneles Solares (Fotovoltaicos o Híbridos)": {"Category": "Medidas de gestión energética", "Code": "B.6"},
-        "Cambio Iluminacion LED": {"Category": "Medidas de control de iluminación", "Code": "C.1"},
-        "Sustitución de luminarias a LED": {"Category": "Medidas de control de iluminación", "Code": "C.1"},
-        "Instalación regletas programables": {"Category": "Medidas de control de iluminación", "Code": "C.2"},
-        "Mejora en el control de la iluminación": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
-        "Mejora en el control actual de iluminación": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
-        "Mejora en el control actual": {"Category": "Medidas de control de iluminación", "Code": "C.3"},
-        "Sustitución de luminarias a LED y mejora en su control": {"Category": "Medidas de control de iluminación", "Code": "C.4"},
-        "Renovación de Equipamiento Específico": {"Category": "Medidas de equipamiento general", "Code": "D.1"}
-    }
-        
-    def categorizar_por_tipo(df_in):
-        def get_info(texto_medida):
-            for nombre_estandar, info in mapeo_medidas.items():
-                if nombre_estandar.lower() in texto_medida.lower():
-                    return pd.Series([info['Category'], info['Code']])
-            return pd.Series(['Sin categorizar', 'Z.Z'])
-        df_in[['Categoría', 'Base Código Medida']] = df_in['Medida'].apply(get_info)
-        return df_in
-
-    def categorizar_por_intervencion(df_in):
-        def get_type(medida):
-            medida = medida.lower()
-            if any(word in medida for word in ["instalación", "batería", "recuperadores", "solar", "fotovoltaica"]): return 'Instalación de Nuevos Sistemas'
-            if any(word in medida for word in ["sustitución", "cambio", "mejora", "aislamiento"]): return 'Reforma y Actualización de Equipos'
-            if any(word in medida for word in ["prácticas", "cultura", "regulación", "optimización", "reducción"]): return 'Operacional y Comportamental'
-            return 'Intervenciones Específicas'
-        df_in['Categoría'] = df_in['Medida'].apply(get_type)
-        return df_in
-
-    def categorizar_por_financiero(df_in):
-        def get_type(retorno):
-            if retorno <= 0: return 'Sin Coste / Inmediato'
-            if retorno < 2: return 'Resultados Rápidos (< 2 años)'
-            if retorno <= 5: return 'Proyectos Estándar (2-5 años)'
-            return 'Inversiones Estratégicas (> 5 años)'
-        df_in['Categoría'] = df_in['Periodo de retorno'].apply(get_type)
-        return df_in
-
-    def categorizar_por_funcion(df_in):
-        def get_type(medida):
-            medida = medida.lower()
-            if any(word in medida for word in ["hvac", "climatización", "temperatura", "ventilación", "aislamiento", "cortina", "calor", "termo"]): return 'Envolvente y Climatización (HVAC)'
-            if any(word in medida for word in ["led", "iluminación", "luminarias", "eléctrico", "potencia", "reactiva", "condensadores", "regletas"]): return 'Iluminación y Electricidad'
-            if any(word in medida for word in ["gestión", "fotovoltaica", "solar", "prácticas", "remanente", "cultura"]): return 'Gestión y Estrategia Energética'
-            return 'Otras Funciones'
-        df_in['Categoría'] = df_in['Medida'].apply(get_type)
-        return df_in
-        
-    def categorizar_por_ahorro_energetico(df_in):
-        def get_type(medida):
-            medida = medida.lower()
-            if any(word in medida for word in ["gasóleo", "diesel", "caldera", "térmica"]): return 'Ahorros Térmicos (Gas/Combustible)'
-            if any(word in medida for word in ["led", "iluminación", "fotovoltaica", "eléctrico", "potencia", "reactiva", "variadores", "bombas", "regletas"]): return 'Ahorros Eléctricos'
-            return 'Mixto / Operacional'
-        df_in['Categoría'] = df_in['Medida'].apply(get_type)
-        return df_in
-
     # --- Procesamiento de Datos según los Filtros ---
-    mapa_funciones_categorizacion = {
-        'Tipo de Medida': categorizar_por_tipo,
-        'Tipo de Intervención': categorizar_por_intervencion,
-        'Impacto Financiero': categorizar_por_financiero,
-        'Tipo de sistema': categorizar_por_funcion,
-        'Tipo de Ahorro Energético': categorizar_por_ahorro_energetico,
-    }
-    funcion_a_usar = mapa_funciones_categorizacion.get(tipo_analisis)
-    df_categorizado = funcion_a_usar(df_original.copy())
-    
-    # --- APLICACIÓN DE FILTROS NUEVOS ---
-    # 1. Filtrar por Medidas Específicas (Sidebar)
-    if medidas_seleccionadas_filtro:
-        df_categorizado = df_categorizado[df_categorizado['Medida'].isin(medidas_seleccionadas_filtro)]
+    # Las categorías ya vienen calculadas de load_data: solo se elige la columna del análisis activo
+    columna_categoria = columnas_categoria[tipo_analisis]
     
-    # 2. Filtrar por ROI Bin (Si aplica)
-    if tipo_analisis == 'Impacto Financiero' and filtros_roi:
-        df_categorizado = df_categorizado[df_categorizado['Categoría'].isin(filtros_roi)]
-    # ------------------------------------
-
+    # --- APLICACIÓN DE FILTROS ---
+    # Cada filtro se resuelve como máscara sobre el índice precalculado; el frame se materializa una sola vez al final
     if comunidades_seleccionadas:
-        df_filtrado = df_categorizado[df_categorizado['Comunidad Autónoma'].isin(comunidades_seleccionadas)]
+        filtros = {'Comunidad Autónoma': comunidades_seleccionadas}
+        # 1. Filtrar por Medidas Específicas (Sidebar)
+        if medidas_seleccionadas_filtro:
+            filtros['Medida'] = medidas_seleccionadas_filtro
+        # 2. Filtrar por ROI Bin (Si aplica)
+        if tipo_analisis == 'Impacto Financiero' and filtros_roi:
+            filtros[columnas_categoria['Impacto Financiero']] = filtros_roi
         if vista_detallada and centros_seleccionados:
-            df_filtrado = df_filtrado[df_filtrado['Centro'].isin(centros_seleccionados)]
+            filtros['Centro'] = centros_seleccionados
+        with medir_etapa(registro_actual(), 'filtrado', len(df_original)) as etapa:
+            df_filtrado = filtrar_auditoria(df_original, indice, filtros, columna_categoria)
+            etapa['filas_salida'] = len(df_filtrado)
     else:
-        df_filtrado = pd.DataFrame(columns=df_categorizado.columns)
+        df_filtrado = pd.DataFrame(columns=df_original.columns)
 
     # --- Renderizado del Panel Principal ---
-    try:
-        st.image("Logo_ASEPEYO.png", width=250)
-    except:
-        st.write("## ASEPEYO Dashboard") # Fallback si no hay logo
-
-    st.title(f"Análisis de Eficiencia Energética - {selected_file.replace('.csv', '')}") 
+    cabecera(f"Análisis de Eficiencia Energética - {selected_file.replace('.csv', '')}")
     
     # --- RENDERIZADO DE KPIs, GRÁFICOS Y TABLAS ---
     if not df_filtrado.empty:
-        if tipo_analisis == 'Tipo de Medida':
-            df_filtrado['Frecuencia'] = df_filtrado.groupby(['Comunidad Autónoma', 'Base Código Medida']).cumcount() + 1
-            df_filtrado['Código Medida'] = df_filtrado.apply(
-                lambda row: f"{row['Base Código Medida']}.{row['Frecuencia']}" if row['Base Código Medida'] != 'Z.Z' else 'Sin categorizar', axis=1)
-        
         columna_agrupar = 'Centro' if vista_detallada else 'Comunidad Autónoma'
 
         if vista_detallada and not centros_seleccionados:
@@ -267,198 +647,83 @@ if 'df_original' in locals() and not df_original.empty:
         else:
             st.header(f"Vista resumida para {len(comunidades_seleccionadas)} comunidades")
 
-        inversion_total = df_filtrado['Inversión'].sum()
-        ahorro_economico_total = df_filtrado['Ahorro económico'].sum()
-        ahorro_energetico_total = df_filtrado['Ahorro energético'].sum()
-        roi = (ahorro_economico_total / inversion_total) * 100 if inversion_total > 0 else 0
+        # El cubo se recalcula solo cuando cambia el estado de los filtros (no al cambiar opciones de visualización)
+        clave_cubo = (
+            file_path, huella_archivo(file_path), tipo_analisis, columna_agrupar, tuple(medidas_seleccionadas_filtro),
+            tuple(filtros_roi), tuple(comunidades_seleccionadas), tuple(centros_seleccionados)
+        )
+        if st.session_state.get('clave_cubo') != clave_cubo:
+            with medir_etapa(registro_actual(), 'agregacion', len(df_filtrado)) as etapa:
+                st.session_state.cubo = construir_cubo(df_filtrado, columna_agrupar)
+                st.session_state.clave_cubo = clave_cubo
+                etapa['filas_salida'] = len(st.session_state.cubo[0])
+        cubo, resumen_grupo = st.session_state.cubo
+
+        kpis = indicadores_resumen(resumen_grupo)
 
         kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-        kpi1.metric(label="Inversión Total", value=f"€ {inversion_total:,.0f}")
-        kpi2.metric(label="Ahorro Económico Total", value=f"€ {ahorro_economico_total:,.0f}")
-        kpi3.metric(label="Ahorro Energético Total", value=f"{ahorro_energetico_total:,.0f} kWh")
-        kpi4.metric(label="Retorno de la Inversión (Cada ano)", value=f"{roi:.2f} %")
+        kpi1.metric(label="Inversión Total", value=f"€ {kpis['inversion']:,.0f}")
+        kpi2.metric(label="Ahorro Económico Total", value=f"€ {kpis['ahorro_economico']:,.0f}")
+        kpi3.metric(label="Ahorro Energético Total", value=f"{kpis['ahorro_energetico']:,.0f} kWh")
+        kpi4.metric(label="Retorno de la Inversión (Cada ano)", value=f"{kpis['roi']:.2f} %")
         st.markdown("---")
 
         col1, col2 = st.columns(2, gap="large")
 
         with col1:
-            st.subheader(f"Recuento de Medidas por {tipo_analisis}")
-            datos_agregados = df_filtrado.groupby([columna_agrupar, 'Categoría']).agg(
-                Recuento=('Medida', 'size'),
-                Medidas=('Medida', lambda x: '<br>'.join(x.unique()))
-            ).reset_index()
-
-            if mostrar_porcentaje:
-                recuentos_totales = datos_agregados.groupby(columna_agrupar)['Recuento'].transform('sum')
-                datos_agregados['Porcentaje'] = (datos_agregados['Recuento'] / recuentos_totales) * 100
-                y_val, y_label = 'Porcentaje', 'Porcentaje de Medidas (%)'
-            else:
-                y_val, y_label = 'Recuento', 'Número de Medidas'
-
-            fig1 = px.bar(datos_agregados, x=columna_agrupar, y=y_val, color='Categoría', hover_data=['Medidas'], title=f'Recuento de Medidas por {columna_agrupar}')
-            fig1.update_layout(yaxis_title=y_label, xaxis_title=columna_agrupar, legend_title=tipo_analisis, template="plotly_white")
-            st.plotly_chart(fig1, use_container_width=True)
-
-            st.subheader("Análisis del Ahorro Energético")
-            agg_energia = df_filtrado.groupby(columna_agrupar).agg(
-                Ahorro_Total_Energia=('Ahorro energético', 'sum'),
-                Medidas=('Medida', lambda x: '<br>'.join(x.unique()))
-            ).reset_index()
-
-            if mostrar_porcentaje:
-                ahorro_general_total = agg_energia['Ahorro_Total_Energia'].sum()
-                agg_energia['Porcentaje'] = (agg_energia['Ahorro_Total_Energia'] / ahorro_general_total) * 100 if ahorro_general_total > 0 else 0
-                y_val, y_label = 'Porcentaje', 'Contribución al Ahorro Total (%)'
-            else:
-                y_val, y_label = 'Ahorro_Total_Energia', 'Ahorro Energético (kWh)'
-
-            fig5 = px.bar(agg_energia.sort_values('Ahorro_Total_Energia', ascending=False), x=columna_agrupar, y=y_val, hover_data=['Medidas'], title=f'Ahorro Energético por {columna_agrupar}')
-            fig5.update_layout(yaxis_title=y_label, xaxis_title=columna_agrupar, template="plotly_white")
-            st.plotly_chart(fig5, use_container_width=True)
+            panel_grafico(f"Recuento de Medidas por {tipo_analisis}", figura_recuento, cubo, clave_cubo, mostrar_porcentaje,
+                          columna_agrupar=columna_agrupar, tipo_analisis=tipo_analisis)
+            panel_grafico("Análisis del Ahorro Energético", figura_ahorro_energetico, resumen_grupo, clave_cubo, mostrar_porcentaje,
+                          columna_agrupar=columna_agrupar)
 
         with col2:
-            st.subheader("Análisis del Ahorro Económico")
-            agg_eco = df_filtrado.groupby(columna_agrupar).agg(
-                Ahorro_Total_Economico=('Ahorro económico', 'sum'),
-                Recuento_Medidas=('Medida', 'size')
-            ).reset_index()
-            fig6 = px.pie(agg_eco, names=columna_agrupar, values='Ahorro_Total_Economico', title=f'Contribución al Ahorro Económico por {columna_agrupar}', hole=0.4, hover_data=['Recuento_Medidas'])
-            fig6.update_traces(hovertemplate='<b>%{label}</b><br>Ahorro Económico: €%{value:,.0f}<br>Nº de Medidas: %{customdata[0]}<extra></extra>')
-            st.plotly_chart(fig6, use_container_width=True)
-            
-            st.subheader("Inversión vs. Ahorro Económico")
-            resumen_fin = df_filtrado.groupby(columna_agrupar).agg(
-                Inversion_Total=('Inversión', 'sum'),
-                Ahorro_Total_Economico=('Ahorro económico', 'sum')
-            ).reset_index()
-            
-            if mostrar_porcentaje and not resumen_fin.empty:
-                inversion_total_todo = resumen_fin['Inversion_Total'].sum()
-                ahorro_total_todo = resumen_fin['Ahorro_Total_Economico'].sum()
-                resumen_fin['Inversión %'] = (resumen_fin['Inversion_Total'] / inversion_total_todo) * 100 if inversion_total_todo > 0 else 0
-                resumen_fin['Ahorro %'] = (resumen_fin['Ahorro_Total_Economico'] / ahorro_total_todo) * 100 if ahorro_total_todo > 0 else 0
-                fig7 = px.scatter(
-                    resumen_fin, x='Inversión %', y='Ahorro %', text=columna_agrupar, size='Inversion_Total',
-                    color=columna_agrupar, title='% de Contribución a Inversión vs. Ahorro',
-                    labels={'Inversión %': '% Inversión Total', 'Ahorro %': '% Ahorro Total'}
-                )
-            else:
-                fig7 = px.scatter(
-                    resumen_fin, x='Inversion_Total', y='Ahorro_Total_Economico', text=columna_agrupar,
-                    size='Inversion_Total', color=columna_agrupar, title=f'Inversión vs. Ahorro Económico por {columna_agrupar}'
-                )
-            fig7.update_traces(textposition='top center')
-            fig7.update_layout(xaxis_title="Inversión (€)", yaxis_title="Ahorro Anual (€)", template="plotly_white")
-            st.plotly_chart(fig7, use_container_width=True)
+            panel_grafico("Análisis del Ahorro Económico", figura_ahorro_economico, resumen_grupo, clave_cubo, None,
+                          columna_agrupar=columna_agrupar)
+            panel_grafico("Inversión vs. Ahorro Económico", figura_inversion_ahorro, resumen_grupo, clave_cubo, mostrar_porcentaje,
+                          columna_agrupar=columna_agrupar)
         
         st.markdown("---")
         st.header("Análisis Avanzado")
         adv_col1, adv_col2 = st.columns(2, gap="large")
 
         with adv_col1:
-            st.subheader("Eficacia de la Inversión")
-            datos_grafico = df_filtrado[(df_filtrado['Inversión'] > 0) & (df_filtrado['Ahorro económico'] > 0)]
-            if not datos_grafico.empty:
-                if mostrar_porcentaje:
-                    inversion_total_todo = datos_grafico['Inversión'].sum()
-                    ahorro_total_todo = datos_grafico['Ahorro económico'].sum()
-                    datos_grafico['Inversión %'] = (datos_grafico['Inversión'] / inversion_total_todo) * 100 if inversion_total_todo > 0 else 0
-                    datos_grafico['Ahorro %'] = (datos_grafico['Ahorro económico'] / ahorro_total_todo) * 100 if ahorro_total_todo > 0 else 0
-                    eje_x, eje_y = 'Inversión %', 'Ahorro %'
-                    label_x, label_y = '% de Inversión Total', '% de Ahorro Total'
-                    texto_titulo = "Contribución Relativa a Inversión vs. Ahorro"
-                else:
-                    eje_x, eje_y = 'Inversión', 'Ahorro económico'
-                    label_x, label_y = 'Inversión (€)', 'Ahorro Anual (€)'
-                    texto_titulo = "Inversión vs. Ahorro Anual"
-                fig_burbuja = px.scatter(
-                    datos_grafico, x=eje_x, y=eje_y, size='Ahorro energético', color='Categoría',
-                    hover_name='Medida',
-                    hover_data=['Centro'],
-                    size_max=60, title=texto_titulo, template="plotly_white"
-                )
-                fig_burbuja.update_layout(xaxis_title=label_x, yaxis_title=label_y, legend_title=tipo_analisis)
-                st.plotly_chart(fig_burbuja, use_container_width=True)
-            else:
-                st.info("No hay datos de inversión y ahorro para este filtro. ")
+            panel_grafico("Eficacia de la Inversión", figura_eficacia_inversion, df_filtrado, clave_cubo, mostrar_porcentaje,
+                          mensaje_vacio="No hay datos de inversión y ahorro para este filtro. ", modos=MODOS_DISPERSION,
+                          tipo_analisis=tipo_analisis)
 
         with adv_col2:
-            st.subheader("Distribución del Periodo de Retorno")
-            payback_data = df_filtrado[df_filtrado['Periodo de retorno'] > 0]
-            if not payback_data.empty:
-                if mostrar_porcentaje:
-                    histnorm_val = 'percent'
-                    y_axis_title = '% del Total de Medidas'
-                    title_text = "Distribución Porcentual de los Periodos de Retorno"
-                else:
-                    histnorm_val = None
-                    y_axis_title = 'Número de Medidas'
-                    title_text = "Distribución de los Periodos de Retorno"
-                
-                fig_hist = px.histogram(
-                    payback_data,
-                    x='Periodo de retorno',
-                    nbins=20,
-                    histnorm=histnorm_val,
-                    hover_data=['Centro', 'Medida'],
-                    template="plotly_white",
-                    title=title_text
-                )
-                
-                fig_hist.update_layout(
-                    xaxis_title="Periodo de Retorno (Años)",
-                    yaxis_title=y_axis_title
-                )
-                st.plotly_chart(fig_hist, use_container_width=True)
-            else:
-                st.info("No hay datos del Periodo de retorno para este filtro.")
+            panel_grafico("Distribución del Periodo de Retorno", figura_periodo_retorno, df_filtrado, clave_cubo, mostrar_porcentaje,
+                          mensaje_vacio="No hay datos del Periodo de retorno para este filtro.")
         
         # --- Sankey Diagram (Full Width) ---
-        st.subheader("Flujo de Inversión y Ahorro (Diagrama de Sankey)")
-        datos_sankey = df_filtrado.groupby(['Categoría', columna_agrupar]).agg(Inversion_Total=('Inversión', 'sum'), Ahorro_Total=('Ahorro económico', 'sum')).reset_index()
-        if not datos_sankey.empty and datos_sankey['Inversion_Total'].sum() > 0:
-            todos_nodos = list(pd.concat([datos_sankey['Categoría'], datos_sankey[columna_agrupar]]).unique())
-            fig_sankey = go.Figure(data=[go.Sankey(
-                node=dict(pad=15, thickness=20, line=dict(color="black", width=0.5), label=todos_nodos),
-                link=dict(
-                    source=[todos_nodos.index(cat) for cat in datos_sankey['Categoría']],
-                    target=[todos_nodos.index(center) for center in datos_sankey[columna_agrupar]],
-                    value=datos_sankey['Inversion_Total'],
-                    hovertemplate='Inversión de %{source.label} a %{target.label}: €%{value:,.0f}<br>' + 'Ahorro resultante: €' + datos_sankey['Ahorro_Total'].map('{:,.0f}'.format) + '<extra></extra>'
-                ))])
-            fig_sankey.update_layout(title_text=f"Flujo de Categoría a {columna_agrupar} por Inversión", font_size=12)
-            st.plotly_chart(fig_sankey, use_container_width=True)
+        panel_grafico("Flujo de Inversión y Ahorro (Diagrama de Sankey)", figura_sankey, cubo, clave_cubo, None,
+                      columna_agrupar=columna_agrupar)
+
+        ruta_geojson = os.path.join(DATA_DIR, "georef-spain-comunidad-autonoma.geojson")
+        if os.path.exists(ruta_geojson):
+            panel_mapa(df_filtrado, clave_cubo, ruta_geojson)
+
+        # Si el análisis activo es el tipo de ahorro, su columna ya se expone como 'Categoría'
+        columna_ahorro = 'Categoría' if columnas_categoria[tipo_analisis] == COLUMNA_AHORRO else COLUMNA_AHORRO
+        panel_escenarios(df_filtrado, columna_agrupar, clave_cubo, columna_ahorro)
         
         st.markdown("---")
         st.header("Tablas de Datos")
 
         st.subheader("1. Explicación de Categorías")
-        if tipo_analisis == 'Tipo de Medida':
-            df_explicacion = pd.DataFrame([
-                (info['Category'], desc, info['Code']) for desc, info in mapeo_medidas.items()
-            ], columns=['Categoría', 'Descripción Medida', 'Prefijo Código']).sort_values(by='Prefijo Código')
-        else:
-            df_explicacion = df_filtrado[['Categoría']].drop_duplicates().sort_values('Categoría')
-            df_explicacion['Explicación'] = df_explicacion['Categoría']
-        st.dataframe(df_explicacion, use_container_width=True, hide_index=True)
+        df_explicacion = explicacion_categorias(tipo_analisis, tuple(cubo['Categoría'].unique()))
+        with medir_etapa(registro_actual(), 'tabla:explicacion', len(df_explicacion)):
+            st.dataframe(df_explicacion, use_container_width=True, hide_index=True)
 
-        st.subheader(f"2. Datos Detallados por {columna_agrupar}")
         columnas_a_mostrar = [columna_agrupar, 'Medida', 'Categoría', 'Inversión', 'Ahorro energético', 'Ahorro económico', 'Periodo de retorno']
-        if tipo_analisis == 'Tipo de Medida' and 'Código Medida' in df_filtrado.columns:
+        if tipo_analisis == 'Tipo de Medida':
             columnas_a_mostrar.insert(1, 'Código Medida')
-        df_tabla_financiera = df_filtrado[columnas_a_mostrar].sort_values(by=[columna_agrupar])
-        st.dataframe(
-            df_tabla_financiera, use_container_width=True, hide_index=True,
-            column_config={
-                "Inversión": st.column_config.NumberColumn("Inversión (€)", format="€ %d"),
-                "Ahorro energético": st.column_config.NumberColumn("Ahorro Energético (kWh)", format="%d kWh"),
-                "Ahorro económico": st.column_config.NumberColumn("Ahorro Anual (€)", format="€ %d"),
-                "Periodo de retorno": st.column_config.NumberColumn("Retorno (años)", format="%.1f años"),
-            }
-        )
+        panel_tabla_detalle(df_filtrado, columnas_a_mostrar, columna_agrupar, clave_cubo, f"detalle_{selected_file.replace('.csv', '')}")
     else:
         st.info("No hay datos disponibles para la selección de filtros actual.")
 
 else:
     st.warning("No se pudieron cargar los datos. Por favor, revise la ruta del archivo e inténtelo de nuevo.")
 
+mostrar_diagnostico()
+
@@ -0,0 +1,38 @@
+"""Unión de auditorías de varios años cuyos CSV escriben de forma distinta los mismos nombres."""
+import numpy as np
+import pandas as pd
+
+from analitica import combinar_particiones, clasificar_continuidad
+
+def auditoria(filas):
+    df = pd.DataFrame(filas, columns=['Comunidad Autónoma', 'Centro', 'Medida', 'Ahorro económico'])
+    return df.astype({'Comunidad Autónoma': 'category', 'Centro': 'category', 'Medida': 'category',
+                      'Ahorro económico': np.float32})
+
+def test_continuidad_con_nombres_distintos_por_año():
+    df = combinar_particiones([
+        (2021, auditoria([
+            ('Castilla Y Leon', 'BURGOS', 'Sustitución de luminarias a LED', 10.0),
+            ('EUSKADI', 'Bilbao', 'Instalación cortina de aire', 20.0),
+            ('Andalucia', 'Cádiz', 'Instalación Fotovoltaica', 30.0),
+        ])),
+        (2025, auditoria([
+            ('Castilla y León', 'Burgos', 'Sustitución de luminarias a led', 11.0),
+            ('Euskadi (País Vasco)', 'Bilbao', 'Instalación cortina de aire', 21.0),
+            ('Andalucía', 'Cadiz', 'Recuperadores de calor', 31.0),
+        ])),
+    ])
+    assert sorted(df['Comunidad Autónoma'].unique()) == ['Andalucía', 'Castilla y León', 'País Vasco']
+
+    continuidad = clasificar_continuidad(df, 2021, 2025)
+    estados = continuidad.set_index(['Comunidad Autónoma', 'Medida'])['Estado']
+    assert estados.to_dict() == {
+        ('Castilla y León', 'Sustitución de luminarias a LED'): 'Mantenida',
+        ('País Vasco', 'Instalación cortina de aire'): 'Mantenida',
+        ('Andalucía', 'Instalación Fotovoltaica'): 'Eliminada',
+        ('Andalucía', 'Recuperadores de calor'): 'Nueva',
+    }
+
+    # Una sola serie por comunidad en la evolución anual
+    tendencia = df.groupby(['Comunidad Autónoma', 'Año'], observed=True)['Ahorro económico'].sum()
+    assert tendencia.groupby(level=0).size().to_dict() == {'Andalucía': 2, 'Castilla y León': 2, 'País Vasco': 2}
@@ -0,0 +1,26 @@
+"""Medidas auditadas en varios años: se financian una sola vez, con su auditoría más reciente."""
+import numpy as np
+import pandas as pd
+
+from analitica import ultima_auditoria
+from optimizacion import optimizar_cartera
+
+def test_ultima_auditoria_con_nombres_distintos_por_año():
+    df = pd.DataFrame({
+        'Año': np.array([2021, 2025, 2021, 2025], dtype=np.int16),
+        'Comunidad Autónoma': ['EUSKADI', 'Euskadi (País Vasco)', 'Castilla-La Mancha', 'Castilla la Mancha'],
+        'Centro': ['BILBAO', 'Bilbao', 'Albacete', 'Albacete'],
+        'Medida': ['Instalación cortina de aire', 'Instalacion cortina de aire', 'Instalación Fotovoltaica', 'Recuperadores de calor'],
+        'Inversión': np.array([100, 120, 50, 50], dtype=np.float32),
+        'Ahorro económico': np.array([60, 70, 30, 30], dtype=np.float32),
+        'Ahorro energético': np.array([500, 550, 200, 200], dtype=np.float32),
+    }).astype({'Comunidad Autónoma': 'category', 'Centro': 'category', 'Medida': 'category'})
+
+    candidatas = ultima_auditoria(df).reset_index(drop=True)
+    # La cortina de Bilbao solo queda con su auditoría de 2025; las dos medidas de Albacete son distintas
+    assert candidatas[['Año', 'Centro']].values.tolist() == [[2025, 'Bilbao'], [2021, 'Albacete'], [2025, 'Albacete']]
+
+    # Con presupuesto para todo, la cortina se financia una vez
+    cartera = optimizar_cartera(candidatas, 1_000, metodo='Exacto')
+    assert cartera['inversion'] == 220
+    assert cartera['valor'] == 130